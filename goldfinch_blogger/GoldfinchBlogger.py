@@ -3,38 +3,42 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
+import json
 import argparse
 import time
-import requests
+import threading
 import pathlib
 from datetime import datetime
-from bs4 import BeautifulSoup
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-from langchain.utilities import GoogleSerperAPIWrapper
-from langchain.chat_models import ChatOpenAI
-from langchain.chains.llm import LLMChain
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.vectorstores import FAISS
-from langchain.chains import RetrievalQA, RetrievalQAWithSourcesChain
-from langchain.prompts import PromptTemplate
-from langchain.experimental.plan_and_execute.schema import (
-    Plan,
-    PlanOutputParser,
-    Step,
-)
+# langchain, faiss, numpy, PyPDF2 and bs4 take seconds to import, so they're
+# imported where they're used, and --help and --dry-run don't wait on them.
+# benchmarks/startup.py fails if one of them creeps back in here.
+from utils.scrapers.base import Scraper, driver_pool, fetcher
+from utils.splitter import text_splitter
+from utils.cache import DiskCache, PageCache, OfflineCacheMiss
+from utils.search import search_client
+from utils.tracing import tracer
 
-from utils.scrapers.base import Scraper
-from utils.threatintel import handle_pdf
-from utils.MemoryRetrievalChain import MemoryRetrievalChain
 
-import tiktoken
-tokenizer = tiktoken.get_encoding("cl100k_base")
+LLM_CHAINS = ['question', 'library', 'search', 'section']
 
+_tokenizer = None
 
-class BlogSectionParser(PlanOutputParser):
-  def parse(self, text: str) -> Plan:
-    steps = [Step(value=v) for v in text.split('SECTION:\n')[1:]]
-    return Plan(steps=steps)
+
+def get_tokenizer():
+  global _tokenizer
+  if _tokenizer is None:
+    import tiktoken
+    _tokenizer = tiktoken.get_encoding("cl100k_base")
+
+  return _tokenizer
+
+
+def parse_sections(outline):
+  """The outline's SECTION: blocks, in order."""
+  return outline.split('SECTION:\n')[1:]
 
 
 class GeneralScraper(Scraper):
@@ -42,14 +46,10 @@ class GeneralScraper(Scraper):
   source = None
   base_url = None
 
-  def __init__(self):
-    self.driver = self.get_selenium()
+  def scrape_post(self, url=None, timeout=None):
+    from bs4 import BeautifulSoup
 
-
-  def scrape_post(self, url=None):
-    self.driver.get(url)
-    time.sleep(5)
-    html = self.driver.execute_script("return document.getElementsByTagName('html')[0].innerHTML")
+    html = self.get_html(url, timeout=timeout)
 
     soup = BeautifulSoup(html, 'lxml')
 
@@ -57,83 +57,228 @@ class GeneralScraper(Scraper):
   
 
 def get_top_n_search(query, n):
-  search = GoogleSerperAPIWrapper()
-  search_result = search.results(query)
+  with tracer.span('search', query=query) as span:
+    try:
+      search_result = search_client.results(query)
+    except OfflineCacheMiss as e:
+      # like a page missing from the cache, only this query loses its results
+      print('Offline and no cached search results for {!r}, skipping it'.format(query))
+      span.error = repr(e)
+      return []
   
   return search_result['organic'][:n]
 
 
-def text_splitter(text, n, tokenizer):
-  chunks = []
-  chunk = ''
-  sentences = [s.strip().replace('\n', ' ') for s in text.split('.')]
-  for s in sentences:
-    # start new chunk
-    if chunk == '':
-      chunk = s
-    else:
-      chunk = chunk + ' ' + s
-    
-    chunk_len = len(tokenizer.encode(chunk))
-    if chunk_len >= 0.9*n:
-      chunks.append(chunk)
-      chunk = ''
+def trace_tier(span, url):
+  tier = fetcher.log.get(url, {}).get('tier')
+  span.set(tier=tier)
+  span.add(page_cache_hits=int(tier == 'cache'))
 
-  if chunk != '':
-    chunks.append(chunk)
-  
-  return chunks
 
+def scrape_and_chunk_pdf(url, n, tokenizer, timeout=None, workers=1):
+  from utils.threatintel import handle_pdf
 
-def scrape_and_chunk_pdf(url, n, tokenizer):
-  r = requests.get(url)
-  with open('tmp.pdf', 'wb') as pdf:
-    pdf.write(r.content)
+  # Keep the download in memory, concurrent scrapes used to clobber a shared tmp.pdf
+  with tracer.span('scrape', url=url) as span:
+    content = fetcher.fetch_bytes(url, timeout=timeout)
+    trace_tier(span, url)
+  name = pathlib.PurePosixPath(urlparse(url).path).name or 'report.pdf'
 
-  return handle_pdf(pathlib.Path('tmp.pdf'), n, tokenizer)
+  with tracer.span('chunk', url=url):
+    return handle_pdf(pathlib.PurePosixPath(name), n, tokenizer, data=content, workers=workers)
 
 
-def scrape_and_chunk(url, token_size, tokenizer):
+def scrape_and_chunk(url, token_size, tokenizer, timeout=None, pdf_workers=1):
   if url.endswith('.pdf'):
-    chunks, pages, meta = scrape_and_chunk_pdf(url, 100, tokenizer)
+    chunks, pages, meta = scrape_and_chunk_pdf(url, 100, tokenizer, timeout=timeout, workers=pdf_workers)
     
     return chunks
   else:
-    scraper = GeneralScraper()
-    soup = scraper.scrape_post(url)
-
-    for script in soup(["script", "style"]):
-      script.extract()
-
-    text = soup.get_text()
-    lines = (line.strip() for line in text.splitlines())
-    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-    results = "\n".join(chunk for chunk in chunks if chunk)
-
-    return text_splitter(results, token_size, tokenizer)
+    with tracer.span('scrape', url=url) as span:
+      results = fetcher.cached_text(url)
+      if results is None:
+        scraper = GeneralScraper()
+        soup = scraper.scrape_post(url, timeout=timeout)
+
+        for script in soup(["script", "style"]):
+          script.extract()
+
+        text = soup.get_text()
+        lines = (line.strip() for line in text.splitlines())
+        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+        results = "\n".join(chunk for chunk in chunks if chunk)
+        fetcher.save_text(url, results)
+      trace_tier(span, url)
+
+    with tracer.span('chunk', url=url):
+      # text with no full stops (menus, tables, code) would otherwise end up in one huge chunk
+      return text_splitter(results, token_size, tokenizer, max_tokens=2*token_size)
   
 
-def get_ephemeral_vecdb(chunks, metadata):
-  embeddings = OpenAIEmbeddings()
+def get_ephemeral_vecdb(chunks, metadata, embeddings=None):
+  from langchain.embeddings.openai import OpenAIEmbeddings
+  from langchain.vectorstores import FAISS
+
+  embeddings = embeddings or OpenAIEmbeddings()
   
   return FAISS.from_texts(chunks, embeddings, metadatas=[metadata for _ in range(len(chunks))])
 
 
+def get_url_context(query, url, llm, embeddings=None, timeout=None, pdf_workers=1):
+  chunks = scrape_and_chunk(url, 100, get_tokenizer(), timeout=timeout, pdf_workers=pdf_workers)
+  vec_db = get_ephemeral_vecdb(chunks, {'source': url}, embeddings)
+
+  return get_sources_context(query, llm, vec_db.as_retriever())
+
+
+def traced_url_task(fn, url):
+  with tracer.span('url', url=url):
+    return fn(url)
+
+
+def run_url_tasks(fn, urls, max_workers=3, timeout=60):
+  # fn(url) for each url, concurrently. Returns ({url: result}, {url: error})
+  results = {}
+  failures = {}
+
+  # One thread per url so a hung site that gets dropped doesn't hold up the
+  # queue; max_workers is enforced here instead of by the executor
+  executor = ThreadPoolExecutor(max_workers=max(1, len(urls)))
+  queue = list(urls)
+  running = {}
+  while queue or running:
+    while queue and len(running) < max(1, max_workers):
+      url = queue.pop(0)
+      print(url)
+      future = executor.submit(tracer.wrap(traced_url_task), fn, url)
+      running[future] = (url, time.monotonic())
+
+    done, _ = wait(running, timeout=0.5, return_when=FIRST_COMPLETED)
+    for future in done:
+      url, _ = running.pop(future)
+      try:
+        results[url] = future.result()
+      except Exception as e:
+        failures[url] = repr(e)
+
+    now = time.monotonic()
+    for future, (url, started) in list(running.items()):
+      if now - started > timeout:
+        running.pop(future)
+        future.cancel()
+        failures[url] = 'TimeoutError(dropped after {}s)'.format(timeout)
+        tracer.event('dropped', url=url, seconds=now - started, error=failures[url])
+
+  # Don't block on dropped urls, their threads finish in the background
+  executor.shutdown(wait=False)
+
+  for url, error in failures.items():
+    print('Issue with {}: {}'.format(url, error))
+
+  return results, failures
+
+
+def get_search_context(query, llm, urls, embeddings=None, max_workers=3, timeout=60, pdf_workers=1):
+  contexts, failures = run_url_tasks(
+    lambda url: get_url_context(query, url, llm, embeddings, timeout, pdf_workers),
+    urls, max_workers=max_workers, timeout=timeout
+  )
+
+  return [contexts[url] for url in urls if url in contexts], failures
+
+
+def get_section_vecdb(url_chunks, embeddings=None):
+  # All urls' chunks in one index, each chunk tagged with its own source
+  from langchain.embeddings.openai import OpenAIEmbeddings
+  from langchain.vectorstores import FAISS
+
+  embeddings = embeddings or OpenAIEmbeddings()
+  texts = []
+  metadatas = []
+  for url, chunks in url_chunks.items():
+    texts.extend(chunks)
+    metadatas.extend({'source': url} for _ in chunks)
+
+  return FAISS.from_texts(texts, embeddings, metadatas=metadatas)
+
+
+def get_chunks_context(query, retriever):
+  docs = retriever.get_relevant_documents(query)
+
+  return '\n'.join('source: {}\n{}'.format(d.metadata['source'], d.page_content) for d in docs)
+
+
+def get_pooled_search_context(queries, llm, embeddings, args):
+  # Scrape every url found for the section once, into a single index, then
+  # run one retrieval per question against it
+  query_urls = {}
+  for query in queries:
+    query_urls[query] = [_url['link'] for _url in get_top_n_search(query, 3)]
+  urls = list(dict.fromkeys(url for urls in query_urls.values() for url in urls))
+
+  url_chunks, failures = run_url_tasks(
+    lambda url: scrape_and_chunk(url, 100, get_tokenizer(), timeout=args.url_timeout, pdf_workers=args.pdf_workers),
+    urls, max_workers=args.max_parallel_urls, timeout=args.url_timeout
+  )
+  url_chunks = {url: chunks for url, chunks in url_chunks.items() if chunks}
+  if not url_chunks:
+    return {query: [] for query in queries}, failures
+
+  retriever = get_section_vecdb(url_chunks, embeddings).as_retriever(search_kwargs={'k': args.search_k})
+
+  contexts = {}
+  for query in queries:
+    if args.search_mode == 'merged':
+      contexts[query] = [get_sources_context(query, llm, retriever)]
+    else:
+      contexts[query] = [get_chunks_context(query, retriever)]
+
+  return contexts, failures
+
+
 def get_sources_context(query, llm, retriever):
-  vec_qa = RetrievalQAWithSourcesChain.from_chain_type(llm=llm, chain_type="stuff", retriever=retriever)
-  res = vec_qa({'question': query})
+  from langchain.chains import RetrievalQAWithSourcesChain
+
+  with tracer.span('qa', query=query):
+    vec_qa = RetrievalQAWithSourcesChain.from_chain_type(llm=llm, chain_type="stuff", retriever=retriever)
+    res = vec_qa({'question': query})
   
   return '\n'.join(['source: {}'.format(res['sources']), res['answer']])
 
 
-def get_context(query, llm, retriever):
-  vec_qa = RetrievalQA.from_chain_type(llm=llm, chain_type="stuff", retriever=retriever)
-  res = vec_qa({'query': query})
-  
-  return res['result']
+def get_library_context(queries, llm, retriever, embeddings):
+  # All of a section's questions in one embeddings request and one index search,
+  # with overlapping hits kept only for the closest question
+  from langchain.chains.question_answering import load_qa_chain
+  from utils.library import search_many
+
+  k = retriever.search_kwargs.get('k', 4)
+  with tracer.span('library') as span:
+    hits = search_many(retriever.vectorstore, embeddings, queries, k=k)
+    span.add(library_chunks=sum(len(docs) for docs in hits.values()))
+  n_hits = sum(len(docs) for docs in hits.values())
+  print('Library: {} chunks for {} questions, {} duplicates dropped'.format(n_hits, len(queries), len(queries)*k - n_hits))
+
+  qa_chain = load_qa_chain(llm, chain_type="stuff")
+  contexts = {}
+  for query, docs in hits.items():
+    if not docs:
+      contexts[query] = ''
+      continue
+
+    with tracer.span('qa', query=query):
+      answer = qa_chain.run(input_documents=docs, question=query)
+    # keep the library's attribution, when its chunks have one, for context packing
+    sources = list(dict.fromkeys(d.metadata['source'] for d in docs if d.metadata.get('source')))
+    contexts[query] = '\n'.join(['source: {}'.format(', '.join(sources)), answer]) if sources else answer
+
+  return contexts
 
 
 def get_question_chain(llm):
+  from langchain.chains.llm import LLMChain
+  from langchain.prompts import PromptTemplate
+
   question_template = """You are a Senior Content writer for a top tier alternative investment platform, Goldfinch. Goldfinch focuses on making private credit accessible to a broad audience.
   You should consider the audience to be an educated lay person, with some, but not much finance background.
 
@@ -156,15 +301,21 @@ def get_question_chain(llm):
   return LLMChain(llm=llm, prompt=question_prompt, verbose=True)
 
 
-def get_library_retriever():
-  embeddings = OpenAIEmbeddings()
+def get_library_retriever(embeddings=None, path='vecstore_backup'):
+  from langchain.embeddings.openai import OpenAIEmbeddings
+  from utils.library import open_library
+
+  embeddings = embeddings or OpenAIEmbeddings()
 
-  # Load from Local
-  db = FAISS.load_local("vecstore_backup", embeddings)
+  # Memory-mapped, and opened once per process
+  db = open_library(path, embeddings)
   return db.as_retriever(search_kwargs={"k": 4})
 
 
 def get_section_chain(llm):
+    from langchain.chains.llm import LLMChain
+    from langchain.prompts import PromptTemplate
+
     _section_draft_prompt = """You are a Senior Content writer for a top tier alternative investment platform, Goldfinch. Goldfinch focuses on making private credit accessible to a broad audience.
     You should consider the audience to be an educated lay person, with some, but not much finance background.
 
@@ -207,94 +358,418 @@ def get_section_chain(llm):
 
 
 
-def main(outline):
-  llm = ChatOpenAI(temperature=1.0)
-  
-  section_parser = BlogSectionParser()
-  sections = section_parser.parse(outline)
-
-  library_retriever = get_library_retriever()
-  question_chain = get_question_chain(llm)
-  section_chain = get_section_chain(llm)
-
-  os.makedirs('new_post/sections', exist_ok=True)
-  # Loop through each section
-  for idx, _section in enumerate(sections.steps):
-    section = _section.value
-    print(section)
-
-    # Get questions for this section
-    questions = question_chain({'input': section})
-    print(questions['text'])
-
-    search_context = []
-    library_context = []
-    # Loop through questions
-    for _query in questions['text'].split('\n'):
-      query = _query.strip()[3:]
-      print(query)
-
-      # library context
-      library_query_context = get_context(query, llm, library_retriever)
-      library_context.append(library_query_context)
+def write_atomic(path, text):
+  tmp = '{}.{}.tmp'.format(path, threading.get_ident())
+  with open(tmp, 'w') as f:
+    f.write(text)
+  os.replace(tmp, path)
+
+
+def load_checkpoint(idx, section, out_dir='new_post'):
+  try:
+    with open(os.path.join(out_dir, 'sections', f'checkpoint{idx}.json')) as f:
+      checkpoint = json.load(f)
+  except (FileNotFoundError, ValueError):
+    return None
+
+  # The outline changed, start this section over
+  if checkpoint.get('section') != section:
+    return None
+
+  return checkpoint
+
+
+def save_checkpoint(idx, checkpoint, out_dir='new_post'):
+  write_atomic(os.path.join(out_dir, 'sections', f'checkpoint{idx}.json'), json.dumps(checkpoint, indent=2))
+
+
+def write_section(idx, section, resources, args, out_dir='new_post'):
+  print(section)
+  llms = resources.llms
+  embeddings = resources.embeddings
+
+  checkpoint = args.resume and load_checkpoint(idx, section, out_dir)
+  if checkpoint:
+    print('Resuming section {} from checkpoint'.format(idx))
+  else:
+    checkpoint = {'section': section, 'library': {}, 'search': {}, 'failures': {}}
+
+  # Get questions for this section
+  if 'questions' not in checkpoint:
+    with tracer.span('questions'):
+      questions = resources.question_chain({'input': section})
+    checkpoint['questions'] = questions['text']
+    save_checkpoint(idx, checkpoint, out_dir)
+  print(checkpoint['questions'])
 
+  # Loop through questions
+  queries = [_query.strip()[3:] for _query in checkpoint['questions'].split('\n')]
+
+  # library context
+  pending = [query for query in queries if query not in checkpoint['library']]
+  if pending:
+    checkpoint['library'].update(get_library_context(pending, llms['library'], resources.library_retriever, embeddings))
+    save_checkpoint(idx, checkpoint, out_dir)
+
+  for query in queries:
+    print(query)
+
+    if args.search_mode == 'per-url' and query not in checkpoint['search']:
       # top n search context
       top_n_search_results = get_top_n_search(query, 3)
 
       # Look through top n urls
-      for _url in top_n_search_results:
-        try:
-          url = _url['link']
-          print(url)
-
-          chunks = scrape_and_chunk(url, 100, tokenizer)
-          vec_db = get_ephemeral_vecdb(chunks, {'source': url})
-          src_context = get_sources_context(query, llm, vec_db.as_retriever())
-          search_context.append(src_context)
-        except:
-          print('Issue with {}'.format(url))
-          continue
-      
-    full_library = '\n'.join(library_context)
-    full_search = '\n'.join(search_context)
+      urls = [_url['link'] for _url in top_n_search_results]
+      src_contexts, failures = get_search_context(
+        query, llms['search'], urls, embeddings,
+        max_workers=args.max_parallel_urls, timeout=args.url_timeout, pdf_workers=args.pdf_workers
+      )
+      checkpoint['search'][query] = src_contexts
+      checkpoint['failures'].update(failures)
+      save_checkpoint(idx, checkpoint, out_dir)
+
+  if args.search_mode != 'per-url' and any(query not in checkpoint['search'] for query in queries):
+    contexts, failures = get_pooled_search_context(queries, llms['search'], embeddings, args)
+    checkpoint['search'].update(contexts)
+    checkpoint['failures'].update(failures)
+    save_checkpoint(idx, checkpoint, out_dir)
+
+  if checkpoint['failures']:
+    print('Section {}: {} url(s) failed: {}'.format(idx, len(checkpoint['failures']), ', '.join(checkpoint['failures'])))
     
+  if 'draft' not in checkpoint:
+    if args.context_budget > 0:
+      from utils.packing import pack_context
+
+      # drop repeated passages and keep the most relevant ones that fit the budget
+      with tracer.span('packing') as span:
+        full_library, full_search, stats = pack_context(
+          section, checkpoint['library'], checkpoint['search'], embeddings, get_tokenizer(), args.context_budget,
+          threshold=args.context_dedup_threshold
+        )
+        span.add(context_tokens_saved=stats['tokens_saved'])
+      checkpoint['packing'] = stats
+      print('Section {}: context {} -> {} tokens ({} saved), kept {} of {} passages, {} repeats and {} near duplicates dropped'.format(
+        idx, stats['tokens_in'], stats['tokens_out'], stats['tokens_saved'], stats['kept'], stats['passages'],
+        stats['repeats'], stats['duplicates']
+      ))
+    else:
+      full_library = '\n'.join(checkpoint['library'].values())
+      full_search = '\n'.join(c for contexts in checkpoint['search'].values() for c in contexts)
 
-    _prompt = section_chain.prompt.format_prompt(**{
+    _prompt = resources.section_chain.prompt.format_prompt(**{
       'input': section,
       'search': full_search,
       'library': full_library
     })
 
+    # Stream tokens into section{idx}.txt.part as they arrive, echoed when sections run one at a time
+    stream = None
+    if args.stream:
+      from utils.streaming import SectionStream
+      stream = SectionStream(os.path.join(out_dir, 'sections', f'section{idx}.txt'), echo=args.max_parallel_sections == 1)
+
     # Write each section with MemoryRetrievalChain
-    res = section_chain({
-      'input': section,
-      'search': full_search,
-      'library': full_library
-    })
+    with tracer.span('draft'):
+      res = resources.section_chain({
+        'input': section,
+        'search': full_search,
+        'library': full_library
+      }, callbacks=[stream] if stream else None)
+
+    checkpoint['prompt'] = _prompt.text
+    checkpoint['draft'] = res['text']
+    if stream and stream.completed:
+      checkpoint['stream'] = stream.stats()
+      print('Section {}: first token after {first_token_seconds:.2f}s, {tokens} tokens at {tokens_per_second:.1f} tokens/s'.format(
+        idx, **checkpoint['stream']
+      ))
+    save_checkpoint(idx, checkpoint, out_dir)
+  else:
+    stream = None
 
+  write_atomic(os.path.join(out_dir, 'sections', f'section_prompt{idx}.txt'), checkpoint['prompt'])
 
-    with open(f'new_post/sections/section_prompt{idx}.txt', 'w') as f:
-        #f.write(f'{heading}\n')
-        f.write(_prompt.text)
-    
-    with open(f'new_post/sections/section{idx}.txt', 'w') as f:
-        #f.write(f'{heading}\n')
-        f.write(res['text'])
+  # a completed stream already renamed the full draft into place
+  if not (stream and stream.completed):
+    write_atomic(os.path.join(out_dir, 'sections', f'section{idx}.txt'), checkpoint['draft'])
 
-    with open('new_post/blog.txt', 'a') as f:
-        #f.write(f'\n\n{heading}\n')
-        f.write(res['text'])
-        f.write('\n\n')
+  return checkpoint['draft']
 
 
+def get_llms(args):
+  from utils.llm_cache import CachedChatOpenAI
+  from utils.trace_callbacks import TraceCallbackHandler
 
-if __name__ == "__main__":
+  # One llm per chain so the response cache can be switched on per chain
+  cache = None
+  if args.llm_cache:
+    cache = DiskCache(
+      os.path.join(args.cache_dir, 'llm.sqlite'),
+      max_bytes=args.llm_cache_max_mb*1024*1024,
+      max_age=args.llm_cache_max_age*3600
+    )
+  cached_chains = LLM_CHAINS if 'all' in args.llm_cache else args.llm_cache
+  # tokens, cost and cache hits of every call go to the run trace
+  trace_handler = TraceCallbackHandler()
+
+  return {
+    name: CachedChatOpenAI(
+      temperature=args.temperature,
+      callbacks=[trace_handler],
+      streaming=args.stream and name == 'section',
+      response_cache=cache if name in cached_chains else None,
+      cache_sampled=args.llm_cache_sampled
+    )
+    for name in LLM_CHAINS
+  }
+
+
+class BlogResources():
+  """What every post of a run shares: LLM clients, embeddings, the library index, chains and caches.
+
+  Building it also configures the shared driver pool, fetcher and search client.
+  """
+
+  def __init__(self, args):
+    self.llms = get_llms(args)
+
+    driver_pool.configure(size=args.driver_pool_size, max_pages=args.driver_max_pages)
+    fetcher.min_text_chars = args.static_min_chars
+    if not args.no_page_cache:
+      fetcher.cache = PageCache(
+        os.path.join(args.cache_dir, 'pages'),
+        ttl=args.page_cache_ttl*3600,
+        max_bytes=args.page_cache_max_mb*1024*1024,
+        offline=args.offline
+      )
+    elif args.offline:
+      raise ValueError('--offline needs the page cache')
+
+    # Questions repeat across sections and re-runs, so reuse their search results
+    if not args.no_search_cache:
+      search_client.cache = DiskCache(
+        os.path.join(args.cache_dir, 'search.sqlite'),
+        max_age=args.search_cache_ttl*3600
+      )
+    search_client.offline = args.offline
+
+    # Only chunks we haven't embedded before go to the API
+    from utils.embeddings import get_embeddings
+    self.embeddings = get_embeddings(None if args.no_embedding_cache else args.cache_dir)
+
+    self.library_retriever = get_library_retriever(self.embeddings, args.library_path)
+    self.question_chain = get_question_chain(self.llms['question'])
+    self.section_chain = get_section_chain(self.llms['section'])
+
+
+def load_outlines(path):
+  """[(name, outline)] from a directory of .txt outlines, or a manifest listing outline paths.
+
+  A manifest is a .json list of paths or {name: path}, or a text file with one path per line.
+  Relative paths are relative to the manifest.
+  """
+  if os.path.isdir(path):
+    paths = {p.stem: p for p in sorted(pathlib.Path(path).glob('*.txt'))}
+  else:
+    root = pathlib.Path(path).parent
+    with open(path) as f:
+      if path.endswith('.json'):
+        entries = json.load(f)
+      else:
+        entries = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    if isinstance(entries, list):
+      names = [pathlib.Path(entry).stem for entry in entries]
+      if len(set(names)) < len(names):
+        raise ValueError('Outline file names repeat in {}, give them names with a JSON manifest'.format(path))
+      entries = dict(zip(names, entries))
+    paths = {name: root / entry for name, entry in entries.items()}
+
+  outlines = []
+  for name, outline_path in paths.items():
+    with open(outline_path) as f:
+      outlines.append((name, f.read()))
+
+  return outlines
+
+
+def submit_post(executor, out_dir, outline, resources, args):
+  """Queue every section of `outline` on `executor`. Returns their futures, in outline order."""
+  os.makedirs(os.path.join(out_dir, 'sections'), exist_ok=True)
+  sections = parse_sections(outline)
+
+  def section_task(idx, section):
+    with tracer.span('section', post=out_dir, section=idx):
+      return write_section(idx, section, resources, args, out_dir)
+
+  return [executor.submit(section_task, idx, section) for idx, section in enumerate(sections)]
+
+
+def assemble_post(out_dir, futures):
+  """Wait for a post's sections and write its blog.txt. Returns (blog, failed section indices)."""
+  drafts = []
+  failed = []
+  for idx, future in enumerate(futures):
+    try:
+      drafts.append(future.result())
+    except Exception as e:
+      print('{} section {} failed: {!r}'.format(out_dir, idx, e))
+      failed.append(idx)
+  if failed:
+    return None, failed
+
+  # Assemble the blog in outline order in one go, so reruns never duplicate content
+  blog = ''.join(draft + '\n\n' for draft in drafts)
+  write_atomic(os.path.join(out_dir, 'blog.txt'), blog)
+  print('Wrote {}'.format(os.path.join(out_dir, 'blog.txt')))
+
+  return blog, []
+
+
+def write_posts(posts, args, resources=None):
+  """Draft each (out_dir, outline) in `posts`, with every post's sections on one bounded pool."""
+  tracer.start()
+  resources = resources or BlogResources(args)
+
+  # Sections don't depend on each other, so draft several at once, across posts too
+  failed = {}
+  with ThreadPoolExecutor(max_workers=max(1, args.max_parallel_sections)) as executor:
+    futures = {out_dir: submit_post(executor, out_dir, outline, resources, args) for out_dir, outline in posts}
+    for out_dir, post_futures in futures.items():
+      _, post_failed = assemble_post(out_dir, post_futures)
+      if post_failed:
+        failed[out_dir] = post_failed
+
+  # Where the run's time, tokens and money went, per stage, section and url
+  tracer.save(
+    os.path.join(args.output_dir, 'trace.json'), args=vars(args), failed=failed,
+    fetch_tiers=dict(fetcher.tier_counts()), search_cache=search_client.stats(),
+    embedding_cache=getattr(resources.embeddings, 'stats', dict)()
+  )
+  tracer.print_summary(keys=('stage', 'section') if len(posts) == 1 else ('stage', 'post'))
+
+  # Which fetch tier served each url, for tuning --static-min-chars
+  fetcher.save_log(os.path.join(args.output_dir, 'fetch_tiers.json'))
+  print('Fetch tiers: {}'.format(dict(fetcher.tier_counts())))
+  print('Search cache: {}'.format(search_client.stats()))
+  print('LLM cache: {}'.format({
+    name: {'hits': llm.cache_hits, 'misses': llm.cache_misses}
+    for name, llm in resources.llms.items() if llm.cacheable()
+  }))
+
+  if failed:
+    raise RuntimeError('Sections failed {}, rerun with --resume to pick up where they left off'.format(failed))
+
+
+def print_plan(posts, args):
+  """What a run would draft, without building clients, the library index or browsers."""
+  for out_dir, outline in posts:
+    sections = parse_sections(outline)
+    print('{}: {} sections'.format(out_dir, len(sections)))
+    for idx, section in enumerate(sections):
+      heading = next((line.strip() for line in section.splitlines() if line.strip()), '')
+      resumed = ' (resumes from checkpoint)' if args.resume and load_checkpoint(idx, section, out_dir) else ''
+      print('  {}. {}{}'.format(idx, heading, resumed))
+
+  print('Sections in parallel: {}, search mode: {}, context budget: {}, LLM cache: {}, library: {}{}'.format(
+    args.max_parallel_sections, args.search_mode, args.context_budget or 'off', ', '.join(args.llm_cache) or 'off',
+    args.library_path, ', offline' if args.offline else ''
+  ))
+
+
+def main(outline, args=None):
+  args = args or get_arg_parser().parse_args([])
+
+  return write_posts([(args.output_dir, outline)], args)
+
+
+def get_arg_parser():
   parser = argparse.ArgumentParser()
   parser.add_argument('--outline_path', type=str)
+  parser.add_argument('--batch', type=str,
+                      help='Directory of .txt outlines, or a manifest listing them, each drafted into its own '
+                           'folder of --output_dir')
+  parser.add_argument('--output_dir', type=str, default='new_post',
+                      help='Where the post (or, with --batch, a folder per post) is written')
+  parser.add_argument('--dry-run', action='store_true',
+                      help='Print the sections that would be drafted and the main settings, then exit')
+  parser.add_argument('--max-parallel-sections', type=int, default=1,
+                      help='Number of sections to research and draft concurrently, across all posts')
+  parser.add_argument('--resume', action='store_true',
+                      help='Pick up each section from its checkpoint in the output sections/ folder')
+  parser.add_argument('--library-path', type=str, default='vecstore_backup',
+                      help='Library vector store folder, built with python -m utils.library')
+  parser.add_argument('--search-mode', default='per-url', choices=['per-url', 'merged', 'direct'],
+                      help='per-url: one index and sourced QA call per url. merged: one index per section and '
+                           'one sourced QA call per question. direct: one index per section, top chunks go '
+                           'straight into the section prompt')
+  parser.add_argument('--search-k', type=int, default=6,
+                      help='Chunks retrieved per question from the section index in merged/direct mode')
+  parser.add_argument('--stream', action='store_true',
+                      help='Stream each section draft to the output sections/ folder (and stdout) as it is generated')
+  parser.add_argument('--context-budget', type=int, default=3000,
+                      help='Tokens of library and search context packed into each section prompt, 0 for all of it')
+  parser.add_argument('--context-dedup-threshold', type=float, default=0.9,
+                      help='Cosine similarity above which a context passage counts as a near duplicate')
+  parser.add_argument('--max-parallel-urls', type=int, default=3,
+                      help='Number of search result urls to scrape and summarize concurrently')
+  parser.add_argument('--url-timeout', type=float, default=60,
+                      help='Seconds before a slow url is dropped from the section')
+  parser.add_argument('--pdf-workers', type=int, default=min(4, os.cpu_count() or 1),
+                      help='Processes used to extract text from large PDFs')
+  parser.add_argument('--driver-pool-size', type=int, default=3,
+                      help='Max number of headless Chrome drivers kept open for scraping')
+  parser.add_argument('--driver-max-pages', type=int, default=25,
+                      help='Page loads before a pooled Chrome driver is recycled')
+  parser.add_argument('--static-min-chars', type=int, default=1000,
+                      help='Visible text a plain GET must return before falling back to Chrome')
+  parser.add_argument('--cache-dir', type=str, default='cache',
+                      help='Directory for the persistent caches')
+  parser.add_argument('--no-page-cache', action='store_true',
+                      help="Don't read or write the scraped page cache")
+  parser.add_argument('--page-cache-ttl', type=float, default=168,
+                      help='Hours before a cached page is revalidated')
+  parser.add_argument('--page-cache-max-mb', type=float, default=500,
+                      help='Size of the page cache before least recently used pages are evicted')
+  parser.add_argument('--offline', action='store_true',
+                      help='Only serve scraped pages from the cache, never fetch them')
+  parser.add_argument('--no-search-cache', action='store_true',
+                      help="Don't read or write the search result cache")
+  parser.add_argument('--search-cache-ttl', type=float, default=24,
+                      help='Hours a cached search result is reused')
+  parser.add_argument('--no-embedding-cache', action='store_true',
+                      help="Don't read or write the chunk embedding cache")
+  parser.add_argument('--temperature', type=float, default=1.0,
+                      help='Sampling temperature for every chain')
+  parser.add_argument('--llm-cache', nargs='+', default=[], choices=LLM_CHAINS + ['all'],
+                      help='Chains whose LLM responses are cached on disk')
+  parser.add_argument('--llm-cache-sampled', action='store_true',
+                      help='Also cache responses sampled at temperature > 0')
+  parser.add_argument('--llm-cache-max-mb', type=float, default=200,
+                      help='Size of the LLM cache before least recently used responses are evicted')
+  parser.add_argument('--llm-cache-max-age', type=float, default=720,
+                      help='Hours before a cached LLM response expires')
+
+  return parser
+
+
+if __name__ == "__main__":
+  parser = get_arg_parser()
       
   args, _ = parser.parse_known_args()
-  print(args.outline_path)
 
-  outline = open(args.outline_path).read()
+  if args.batch:
+    # One process for every outline, so clients, the library index, browsers and caches are set up once
+    outlines = load_outlines(args.batch)
+    print('{} outlines from {}'.format(len(outlines), args.batch))
+    posts = [(os.path.join(args.output_dir, name), outline) for name, outline in outlines]
+  else:
+    print(args.outline_path)
+
+    outline = open(args.outline_path).read()
+    posts = [(args.output_dir, outline)]
 
-  main(outline)
\ No newline at end of file
+  if args.dry_run:
+    print_plan(posts, args)
+  else:
+    write_posts(posts, args)
\ No newline at end of file
@@ -0,0 +1,139 @@
+"""Crawl scheduler wall time for many sources, polled one at a time vs concurrently.
+
+Serves paginated Crowdstrike-style blogs for `--sources` sources from a local HTTP server,
+spread over `--domains` hosts (127.0.0.1, 127.0.0.2, ...), with one source much
+slower than the rest. DataSource watermarks live in the fake Weaviate from
+benchmarks.ingest.
+
+From goldfinch_blogger/: python -m benchmarks.crawl --sources 50 --domains 10
+"""
+import re
+import time
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from utils.crawl import crawl, print_report
+from utils.scrapers.base import fetcher
+from utils.scrapers.crowdstrike import CrowdstrikeScraper
+from utils.scrapers.fetch import DomainLimiter
+from benchmarks.ingest import FakeClient
+from benchmarks.make_fixtures import make_blog_category, make_blog_post
+
+
+class BlogServer(ThreadingHTTPServer):
+    """/blog/<source>/ (and /page/<n>/) list that source's posts, /blog/<source>/post-<n>/ serves one."""
+
+    daemon_threads = True
+
+    def __init__(self, posts_per_source=10, page_size=4, delay=0.2, slow_delay=2.0):
+        super().__init__(('0.0.0.0', 0), BlogHandler)
+        self.posts_per_source = posts_per_source
+        self.page_size = page_size
+        self.delay = delay
+        self.slow_delay = slow_delay
+        self.now = datetime.now().astimezone().replace(hour=12, minute=0, second=0, microsecond=0)
+
+
+    def posts(self, source):
+        return [
+            {
+                'url': '/blog/{}/post-{}/'.format(source, n),
+                'title': 'Source {} post {}'.format(source, n),
+                'date': self.now - timedelta(days=n),
+                'author': 'Analyst {}'.format(source)
+            }
+            for n in range(self.posts_per_source)
+        ]
+
+
+class BlogHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        match = re.match(r'^/blog/(\d+)/(?:post-(\d+)/|page/(\d+)/)?$', self.path)
+        if match is None:
+            self.send_error(404)
+            return
+
+        source = int(match.group(1))
+        time.sleep(self.server.slow_delay if source == 0 else self.server.delay)
+        posts = self.server.posts(source)
+        if match.group(2) is None:
+            start = (int(match.group(3) or 1) - 1) * self.server.page_size
+            body = make_blog_category(posts[start:start + self.server.page_size])
+        else:
+            body = make_blog_post(posts[int(match.group(2))], seed=source)
+
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    def log_message(self, *args):
+        pass
+
+
+# Scraper.__subclasses__() only holds weak references
+_scrapers = []
+
+
+def make_sources(n_sources, n_domains, port):
+    """Scraper subclasses for the local blogs, as crawl source configs."""
+    configs = []
+    for i in range(n_sources):
+        base_url = 'http://127.0.0.{}:{}'.format(1 + i % n_domains, port)
+        cls = type('BenchScraper{}'.format(i), (CrowdstrikeScraper,), {
+            'base_url': base_url,
+            'blog_url': '{}/blog/{}/'.format(base_url, i),
+            'source': 'Bench-{}'.format(i)
+        })
+        _scrapers.append(cls)
+        configs.append({'source': cls.source, 'scraper': cls.__name__})
+
+    return configs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sources', type=int, default=50)
+    parser.add_argument('--domains', type=int, default=10)
+    parser.add_argument('--posts', type=int, default=10, help='Posts per source, 4 to a listing page')
+    parser.add_argument('--delay', type=float, default=0.2, help='Seconds per page')
+    parser.add_argument('--slow-delay', type=float, default=2.0, help='Seconds per page for the slowest source')
+    parser.add_argument('--max-parallel-sources', type=int, default=50)
+    parser.add_argument('--max-per-domain', type=int, default=4)
+    parser.add_argument('--domain-delay', type=float, default=0.05)
+    args = parser.parse_args()
+
+    server = BlogServer(posts_per_source=args.posts, delay=args.delay, slow_delay=args.slow_delay)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    configs = make_sources(args.sources, args.domains, server.server_address[1])
+    fetcher.min_text_chars = 0
+    fetcher.politeness = DomainLimiter(max_per_domain=args.max_per_domain, delay=args.domain_delay)
+
+    def summary(name, report):
+        statuses = [entry['status'] for entry in report['sources']]
+        print('{:<34} {:>6.1f}s  slowest source {:>5.1f}s, sum {:>6.1f}s  {:>4} posts, {} new, {} unchanged, {} errors'.format(
+            name, report['seconds'], report['slowest'], sum(entry['seconds'] for entry in report['sources']),
+            report['posts'], statuses.count('new'), statuses.count('unchanged'), statuses.count('error')
+        ))
+
+    for max_workers in (1, args.max_parallel_sources):
+        client = FakeClient(latency=0.01)
+        server.now = server.now.replace(year=2023)
+        with tempfile.TemporaryDirectory() as out_dir:
+            # first run backfills every post; then nothing; then two new posts per source
+            summary('sources={} backfill'.format(max_workers), crawl(configs, client, out_dir, max_workers=max_workers, max_pages=10))
+            summary('sources={} re-run'.format(max_workers), crawl(configs, client, out_dir, max_workers=max_workers))
+            server.now += timedelta(days=2)
+            report = crawl(configs, client, out_dir, max_workers=max_workers)
+            summary('sources={} two new posts each'.format(max_workers), report)
+        client.batch.shutdown()
+
+    print()
+    print_report(report)
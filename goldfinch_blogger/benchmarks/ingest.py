@@ -0,0 +1,279 @@
+"""Weaviate ingestion throughput, in objects/sec, against a fake Weaviate.
+
+The fake answers the real client's batch and single-object calls with a fixed
+per-request latency, and can rate limit objects like an OpenAI vectorizer
+does, so the batch path, its backoff and the old one-object-at-a-time path
+can be compared without a server. Then re-runs with the ingest manifest, and
+with the Weaviate existence check, show what is still sent.
+
+From goldfinch_blogger/: python -m benchmarks.ingest --reports 20 --latency 0.02 --rate-limit 2000
+"""
+import os
+import json
+import time
+import random
+import datetime
+import argparse
+import tempfile
+import threading
+
+import requests
+from weaviate.batch import Batch
+
+from utils.ingest import find_reports, ingest_reports, print_stats
+from utils.threatintel import BatchLoader, IngestManifest, read_threatintel_report
+from benchmarks.make_fixtures import make_pdf, sentences
+
+
+class FakeConnection():
+    """Stands in for weaviate.connect.Connection behind a real Batch."""
+
+    timeout_config = (2, 20)
+    server_version = '1.21.0'
+
+    def __init__(self, latency=0.02, per_object=0.0001, rate_limit=None):
+        self.latency = latency
+        self.per_object = per_object
+        self.rate_limit = rate_limit
+        self.requests = 0
+        self.rate_limited = 0
+        self.stored = {}
+        self._lock = threading.Lock()
+        self._window = (time.monotonic(), 0)
+
+
+    def allow(self):
+        # objects vectorized in the current one second window
+        if self.rate_limit is None:
+            return True
+        with self._lock:
+            start, count = self._window
+            if time.monotonic() - start >= 1:
+                start, count = time.monotonic(), 0
+            self._window = (start, count + 1)
+            if count < self.rate_limit:
+                return True
+            self.rate_limited += 1
+            return False
+
+
+    def post(self, path, weaviate_object, params=None):
+        start = time.perf_counter()
+        items = weaviate_object['objects'] if path == '/batch/objects' else weaviate_object
+        time.sleep(self.latency + self.per_object * len(items))
+
+        results = []
+        for item in items:
+            if path == '/batch/objects' and not self.allow():
+                error = {'errors': {'error': [{'message': 'update vector: API request failed with status: 429 Too Many Requests'}]}}
+                results.append(dict(item, result=error))
+            else:
+                results.append(dict(item, result={}))
+                if path == '/batch/objects':
+                    self.stored[item['id']] = item
+        with self._lock:
+            self.requests += 1
+
+        return fake_response(results, time.perf_counter() - start)
+
+
+    def get(self, path, params=None):
+        return fake_response({'nodes': [{'name': 'fake', 'status': 'HEALTHY'}]})
+
+
+class FakeDataObject():
+    """data_object.create, data_object.update and data_object.reference.add, one request each."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.reference = self
+
+
+    def create(self, data_object, class_name, uuid=None, vector=None):
+        time.sleep(self.connection.latency)
+        self.connection.requests += 1
+        self.connection.stored[uuid] = {'class': class_name, 'id': uuid, 'properties': dict(data_object)}
+        return uuid
+
+
+    def update(self, data_object, class_name, uuid):
+        time.sleep(self.connection.latency)
+        self.connection.requests += 1
+        self.connection.stored[uuid]['properties'].update(data_object)
+
+
+    def add(self, **kwargs):
+        time.sleep(self.connection.latency)
+        self.connection.requests += 1
+
+
+class FakeQuery():
+    """query.get(...).with_where(...).with_limit(...).do() over the objects a FakeConnection stored."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+
+    def get(self, class_name, properties):
+        self.class_name = class_name
+        return self
+
+
+    def with_where(self, where_filter):
+        self.operands = where_filter.get('operands', [where_filter])
+        return self
+
+
+    def with_limit(self, limit):
+        return self
+
+
+    def matches(self, uuid, item):
+        for operand in self.operands:
+            path = operand['path'][0]
+            value = uuid if path == 'id' else item['properties'].get(path)
+            if value == operand['valueString']:
+                return True
+        return False
+
+
+    def do(self):
+        time.sleep(self.connection.latency)
+        found = [
+            dict(item['properties'], _additional={'id': uuid})
+            for uuid, item in list(self.connection.stored.items())
+            if item['class'] == self.class_name and self.matches(uuid, item)
+        ]
+        return {'data': {'Get': {self.class_name: found}}}
+
+
+class FakeClient():
+
+    def __init__(self, **kwargs):
+        self.connection = FakeConnection(**kwargs)
+        self.batch = Batch(self.connection)
+        self.data_object = FakeDataObject(self.connection)
+        self.query = FakeQuery(self.connection)
+
+
+def fake_response(body, seconds=0.0):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = json.dumps(body).encode('utf-8')
+    response.elapsed = datetime.timedelta(seconds=max(seconds, 1e-6))
+
+    return response
+
+
+def make_reports(root, n_reports, pdf_pages=20, seed=0):
+    """Every fourth report a PDF of `pdf_pages` pages, the rest JSON blog posts."""
+    rng = random.Random(seed)
+    for i in range(n_reports):
+        title = 'Fixture Report {}'.format(i)
+        if i % 4 == 0:
+            with open('{}/report{}.pdf'.format(root, i), 'wb') as f:
+                f.write(make_pdf(pdf_pages, seed=i, title=title))
+        else:
+            with open('{}/report{}.json'.format(root, i), 'w') as f:
+                json.dump({
+                    'title': title,
+                    'author': 'Goldfinch Benchmarks',
+                    'date': '2023-06-01T12:00:00+00:00',
+                    'url': 'https://example.com/report{}'.format(i),
+                    'source': 'benchmarks',
+                    'content': ' '.join(sentences(rng, 300))
+                }, f)
+
+
+def legacy_load(client, chunks, pages, meta):
+    # The old path: one create per object, one reference.add per chunk->report link
+    from weaviate.util import generate_uuid5
+
+    chunk_uuids = []
+    for chunk, page in zip(chunks, pages):
+        uuid = generate_uuid5({'chunk': chunk}, 'ThreatIntelChunk')
+        chunk_uuids.append(uuid)
+        client.data_object.create({'chunk': chunk, 'page': page}, 'ThreatIntelChunk', uuid)
+
+    report_uuid = generate_uuid5(meta, 'ThreatIntelReport')
+    client.data_object.create(meta, 'ThreatIntelReport', report_uuid)
+    for chunk_uuid in chunk_uuids:
+        client.data_object.reference.add(
+            from_uuid=report_uuid, from_property_name='hasChunks', to_uuid=chunk_uuid,
+            from_class_name='ThreatIntelReport', to_class_name='ThreatIntelChunk'
+        )
+
+    return len(chunk_uuids) + 1, len(chunk_uuids)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reports', type=int, default=20)
+    parser.add_argument('--pdf-pages', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds per request to the fake Weaviate')
+    parser.add_argument('--rate-limit', type=int, help='Objects/sec the fake vectorizer accepts before 429s')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--batch-workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--workers', type=int, default=1, help='Processes reading and chunking reports')
+    parser.add_argument('--skip-legacy', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        make_reports(root, args.reports, args.pdf_pages)
+        paths = find_reports(root)
+
+        if not args.skip_legacy:
+            client = FakeClient(latency=args.latency)
+            reports = [read_threatintel_report(str(path)) for path in paths]
+            start = time.perf_counter()
+            n_objects = n_references = 0
+            for chunks, pages, meta in reports:
+                objects, references = legacy_load(client, chunks, pages, meta)
+                n_objects += objects
+                n_references += references
+            seconds = time.perf_counter() - start
+            print('legacy            {:>8.1f} objects/s {:>8.1f} refs/s  {:>5} requests'.format(
+                n_objects / seconds, n_references / seconds, client.connection.requests
+            ))
+
+        for batch_workers in args.batch_workers:
+            client = FakeClient(latency=args.latency, rate_limit=args.rate_limit)
+            loader = BatchLoader(client, batch_size=args.batch_size, num_workers=batch_workers)
+            stats = ingest_reports(paths, loader, workers=args.workers)
+            client.batch.shutdown()
+            print('batch workers={:<3} {:>8.1f} objects/s {:>8.1f} refs/s  {:>5} requests  {} rate limited'.format(
+                batch_workers, loader.objects / stats['seconds'], loader.references / stats['seconds'],
+                client.connection.requests, client.connection.rate_limited
+            ))
+        print()
+        print_stats(stats, loader)
+
+        # Re-runs: unchanged reports are skipped by file hash, and a corpus
+        # that overlaps what's loaded only sends its new chunks
+        client = FakeClient(latency=args.latency)
+        loader = BatchLoader(client, batch_size=args.batch_size, num_workers=max(args.batch_workers))
+        manifest = IngestManifest(os.path.join(root, 'manifest', 'ingest.sqlite'))
+        for run in ('first run', 're-run', 'overlapping'):
+            if run == 'overlapping':
+                # new reports, plus copies of loaded ones saved differently
+                make_reports(root, args.reports + args.reports // 2, args.pdf_pages)
+                for path in [path for path in paths if path.suffix == '.json'][:3]:
+                    with open(path) as f:
+                        report = json.load(f)
+                    with open(str(path).replace('.json', '_copy.json'), 'w') as f:
+                        json.dump(report, f, indent=2)
+            objects, references = loader.objects, loader.references
+            stats = ingest_reports(find_reports(root), loader, workers=args.workers, manifest=manifest)
+            print('{:<12} {:>3} reports read, {:>3} skipped, {:>6} objects sent, {:>6} skipped, {:>6} refs sent'.format(
+                run, stats['reports'], stats['skipped_reports'], loader.objects - objects, stats['skipped_objects'],
+                loader.references - references
+            ))
+
+        # Without a manifest, ask Weaviate which objects it already has
+        objects, references = loader.objects, loader.references
+        stats = ingest_reports(find_reports(root), loader, workers=args.workers, check_weaviate=True)
+        print('{:<12} {:>3} reports read, {:>3} skipped, {:>6} objects sent, {:>6} skipped, {:>6} refs sent'.format(
+            'weaviate', stats['reports'], stats['skipped_reports'], loader.objects - objects, stats['skipped_objects'],
+            loader.references - references
+        ))
+        client.batch.shutdown()
@@ -0,0 +1,70 @@
+"""Library index types at scale: recall@k vs latency, and RSS after opening.
+
+Uses synthetic clustered vectors, so no corpus or API key is needed.
+
+From goldfinch_blogger/: python -m benchmarks.library --chunks 300000 --dim 256
+"""
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+import faiss
+
+from utils.library import INDEX_TYPES, build_index, evaluate, print_rows, sample_queries
+
+
+def make_vectors(n, dim, n_clusters=1000, seed=0):
+    # Topics as cluster centres, chunks scattered around them, unit length like OpenAI embeddings
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    vectors = centres[rng.integers(n_clusters, size=n)] + 0.5 * rng.normal(size=(n, dim)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+
+    return vectors
+
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+
+
+def open_rss(path, mmap):
+    """RSS a fresh process adds by opening the index at `path`."""
+    code = (
+        'import sys; from benchmarks.library import rss_mb; from utils.library import read_index; '
+        'before = rss_mb(); index = read_index(sys.argv[1], mmap=sys.argv[2] == "1"); print(rss_mb() - before)'
+    )
+    out = subprocess.run([sys.executable, '-c', code, path, str(int(mmap))], capture_output=True, text=True, check=True)
+
+    return float(out.stdout)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--k', type=int, default=4)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--index', nargs='+', default=INDEX_TYPES, choices=INDEX_TYPES)
+    parser.add_argument('--nprobe', type=int, default=16)
+    parser.add_argument('--ef-search', type=int, default=64)
+    args = parser.parse_args()
+
+    vectors = make_vectors(args.chunks, args.dim)
+    queries = sample_queries(vectors, args.queries, noise=0.2)
+    print('{} chunks, {}-d, {:.0f} MB of vectors'.format(args.chunks, args.dim, vectors.nbytes / 1e6))
+
+    print_rows(evaluate(vectors, queries, args.index, k=args.k, nprobe=args.nprobe, ef_search=args.ef_search))
+
+    if os.path.exists('/proc/self/statm'):
+        print()
+        with tempfile.TemporaryDirectory() as tmp:
+            for index_type in args.index:
+                path = os.path.join(tmp, index_type + '.faiss')
+                faiss.write_index(build_index(vectors, index_type)[0], path)
+                print('open {:<6} RSS +{:>7.1f} MB in memory  +{:>7.1f} MB mmapped'.format(
+                    index_type, open_rss(path, mmap=False), open_rss(path, mmap=True)
+                ))
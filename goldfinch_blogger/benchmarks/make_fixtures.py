@@ -0,0 +1,110 @@
+import random
+
+
+WORDS = (
+    'the loan lender borrower covenant yield credit private fund default rate senior secured floating '
+    'interest income portfolio diversification return volatility equity bond real estate venture '
+    'capital leverage spread maturity amortization underwriting recovery'
+).split()
+
+
+def sentences(rng, n):
+    return [
+        ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 24))).capitalize() + '.'
+        for _ in range(n)
+    ]
+
+
+def make_pdf(n_pages, lines_per_page=45, seed=0, title='Fixture Report'):
+    """A text-only PDF with `n_pages` pages of filler prose, as bytes."""
+    rng = random.Random(seed)
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    pages = add(None)
+    font = add(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>')
+
+    kids = []
+    for _ in range(n_pages):
+        lines, line = [], ''
+        for word in ' '.join(sentences(rng, 30)).split(' '):
+            if len(line) + len(word) > 95:
+                lines.append(line)
+                line = word
+            else:
+                line = (line + ' ' + word).strip()
+            if len(lines) == lines_per_page:
+                break
+
+        text = ' '.join('({}) \''.format(l) for l in lines)
+        stream = 'BT /F1 9 Tf 40 760 Td 11 TL {} ET'.format(text).encode('latin-1')
+        contents = add(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+        kids.append(add(
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] '
+            b'/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>' % (pages, font, contents)
+        ))
+
+    objects[catalog - 1] = b'<< /Type /Catalog /Pages %d 0 R >>' % pages
+    objects[pages - 1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+        b' '.join(b'%d 0 R' % k for k in kids), len(kids)
+    )
+    info = add(
+        b"<< /Title (%s) /Author (Goldfinch Benchmarks) /CreationDate (D:20230601120000+00'00') >>"
+        % title.encode('latin-1')
+    )
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for num, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n' % num + body + b'\nendobj\n'
+
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for offset in offsets:
+        out += b'%010d 00000 n \n' % offset
+    out += b'trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+        len(objects) + 1, catalog, info, xref
+    )
+
+    return bytes(out)
+
+
+def make_html(title, n_paragraphs=12, seed=0):
+    rng = random.Random(seed)
+    paragraphs = ''.join(
+        '<p>{}</p>\n'.format(' '.join(sentences(rng, 6))) for _ in range(n_paragraphs)
+    )
+
+    return (
+        '<html><head><title>{0}</title><style>p {{ margin: 0 }}</style></head>\n'
+        '<body><nav>Home About Contact</nav><article><h1>{0}</h1>\n{1}</article>\n'
+        '<script>var tracking = true;</script></body></html>\n'
+    ).format(title, paragraphs)
+
+
+def make_blog_category(posts):
+    """A Crowdstrike-style blog category page listing `posts` ({'url', 'title', 'date', 'author'})."""
+    articles = ''.join(
+        '<div class="row category_article flex-lg-row"><h3><a href="{url}">{title}</a></h3>'
+        '<div class="publish_info"><p>{date:%B %d, %Y}</p><a href="#">{author}</a></div></div>\n'.format(**post)
+        for post in posts
+    )
+
+    return '<html><body><main>\n{}</main></body></html>\n'.format(articles)
+
+
+def make_blog_post(post, n_paragraphs=8, seed=0):
+    """A Crowdstrike-style blog post page for `post`."""
+    rng = random.Random(seed)
+    paragraphs = ''.join('<p>{}</p>\n'.format(' '.join(sentences(rng, 6))) for _ in range(n_paragraphs))
+
+    return (
+        '<html><body><article><h1>{title}</h1>'
+        '<div class="publish_info"><p>{date:%B %d, %Y}</p><a href="#">{author}</a></div>\n'
+        '<div class="blog_content">\n{paragraphs}</div></article></body></html>\n'
+    ).format(paragraphs=paragraphs, **post)
@@ -0,0 +1,50 @@
+"""PDF text extraction throughput at 1 and N worker processes.
+
+From goldfinch_blogger/: python -m benchmarks.pdf --pages 400 --workers 4
+"""
+import os
+import time
+import pathlib
+import argparse
+
+import tiktoken
+
+from utils.pdf import iter_page_text
+from utils.threatintel import handle_pdf
+from benchmarks.make_fixtures import make_pdf
+
+
+def bench_extract(data, workers):
+    start = time.perf_counter()
+    n_pages = sum(1 for _ in iter_page_text(data, workers=workers))
+    seconds = time.perf_counter() - start
+
+    return n_pages, seconds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=400)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk-size', type=int, default=100)
+    args = parser.parse_args()
+
+    data = make_pdf(args.pages)
+    print('Fixture: {} pages, {:.1f} MB'.format(args.pages, len(data) / 1e6))
+
+    results = {}
+    for workers in sorted({1, args.workers}):
+        n_pages, seconds = bench_extract(data, workers)
+        results[workers] = n_pages / seconds
+        print('extract  workers={:<3} {:>8.1f} pages/s  ({:.2f}s)'.format(workers, results[workers], seconds))
+
+    if len(results) > 1:
+        print('speedup  {:.2f}x'.format(results[args.workers] / results[1]))
+
+    # The whole path: extraction streaming into the splitter
+    tokenizer = tiktoken.get_encoding("cl100k_base")
+    for workers in sorted({1, args.workers}):
+        start = time.perf_counter()
+        chunks, pages, meta = handle_pdf(pathlib.PurePosixPath('fixture.pdf'), args.chunk_size, tokenizer, data=data, workers=workers)
+        seconds = time.perf_counter() - start
+        print('handle_pdf workers={:<3} {:>6} chunks {:>8.1f} pages/s'.format(workers, len(chunks), args.pages / seconds))
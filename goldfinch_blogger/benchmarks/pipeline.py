@@ -0,0 +1,344 @@
+"""End-to-end blog throughput with local stand-ins for OpenAI, Serper and the web.
+
+Each run is GoldfinchBlogger.main() on outline.txt in its own process, with a
+fake chat model and fake embeddings that take `--llm-latency` /
+`--embed-latency`, a Serper stub, and a local HTTP server for the fixture HTML
+and PDF pages the stub links to. No API keys or network needed, though
+tiktoken's cl100k_base file has to be in its cache already.
+
+Reports sections/min, p50/p95 per stage from the run trace and peak RSS, and
+appends every run with the git commit to `--results`, so numbers can be
+compared across commits.
+
+From goldfinch_blogger/: python -m benchmarks.pipeline --runs sequential parallel warm
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+from typing import List
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+from tabulate import tabulate
+from langchain.embeddings.base import Embeddings
+
+from benchmarks.make_fixtures import make_html, make_pdf, sentences
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# run name: (blogger args, whether it starts from empty caches)
+RUNS = {
+    'sequential': (['--max-parallel-sections', '1', '--max-parallel-urls', '1'], True),
+    'parallel': (['--max-parallel-sections', '4', '--max-parallel-urls', '3'], True),
+    'warm': (['--max-parallel-sections', '4', '--max-parallel-urls', '3'], False),
+}
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """/page/<n>.html and /report/<n>.pdf, generated once, each request after `delay` seconds."""
+
+    daemon_threads = True
+
+    def __init__(self, delay=0.2, pdf_pages=20):
+        super().__init__(('127.0.0.1', 0), FixtureHandler)
+        self.delay = delay
+        self.pdf_pages = pdf_pages
+        self.pages = {}
+        self._lock = threading.Lock()
+
+
+    def page(self, kind, n):
+        with self._lock:
+            if (kind, n) not in self.pages:
+                if kind == 'page':
+                    self.pages[kind, n] = ('text/html', make_html('Fixture page {}'.format(n), seed=n).encode('utf-8'))
+                else:
+                    self.pages[kind, n] = ('application/pdf', make_pdf(self.pdf_pages, seed=n, title='Fixture report {}'.format(n)))
+
+            return self.pages[kind, n]
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        match = re.match(r'^/(page|report)/(\d+)\.(?:html|pdf)$', self.path)
+        if match is None:
+            self.send_error(404)
+            return
+
+        time.sleep(self.server.delay)
+        content_type, data = self.server.page(match.group(1), int(match.group(2)))
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    def log_message(self, *args):
+        pass
+
+
+class LatencyEmbeddings(Embeddings):
+    """Deterministic unit vectors per text, one request taking `latency` seconds."""
+
+    model = 'fake-embedding'
+
+    def __init__(self, dim=1536, latency=0.1):
+        self.dim = dim
+        self.latency = latency
+
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        vectors = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+            vector = np.random.default_rng(seed).standard_normal(self.dim)
+            vectors.append((vector / np.linalg.norm(vector)).tolist())
+
+        return vectors
+
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def fake_completion_text(content, draft_words):
+    rng = random.Random(hashlib.sha256(content.encode('utf-8')).hexdigest())
+    if 'QUESTIONS:' in content:
+        # different sections ask different questions, so their searches differ
+        words = sorted(set(re.findall(r'[a-z]{6,}', content.split('following task:')[-1].lower())))
+        topics = rng.sample(words, min(3, len(words))) or ['private credit']
+        return '\n'.join('{}. How does {} matter for private credit investors?'.format(i + 1, topic)
+                         for i, topic in enumerate(topics))
+    if 'LIBRARY CONTEXT' in content:
+        text = ' '.join(sentences(rng, 200))
+        return ' '.join(text.split()[:draft_words])
+    if 'SOURCES' in content:
+        urls = re.findall(r'https?://[^\s]+', content)
+        return '{}\nSOURCES: {}'.format(' '.join(sentences(rng, 4)), urls[0] if urls else '')
+
+    return ' '.join(sentences(rng, 4))
+
+
+def install_fakes(config):
+    """Swap OpenAI, embeddings and Serper for local stand-ins in this process."""
+    import GoldfinchBlogger as gb
+    import utils.embeddings
+    from utils.embeddings import get_embeddings
+    from utils.llm_cache import CachedChatOpenAI
+
+    def completion_with_retry(self, **kwargs):
+        content = kwargs['messages'][-1]['content']
+        text = fake_completion_text(content, config['draft_words'])
+        words = text.split(' ')
+        time.sleep(config['llm_latency'])
+
+        if kwargs.get('stream'):
+            def stream():
+                for word in words:
+                    time.sleep(config['token_latency'])
+                    yield {'choices': [{'delta': {'content': word + ' '}}]}
+            return stream()
+
+        time.sleep(config['token_latency'] * len(words))
+        return {
+            'choices': [{'message': {'role': 'assistant', 'content': text}}],
+            'usage': {'prompt_tokens': len(content) // 4, 'completion_tokens': len(words), 'total_tokens': len(content) // 4 + len(words)}
+        }
+
+    def search(query):
+        time.sleep(config['search_latency'])
+        n = int(hashlib.sha256(query.encode('utf-8')).hexdigest(), 16)
+        base = 'http://127.0.0.1:{}'.format(config['port'])
+        links = [
+            '{}/page/{}.html'.format(base, n % config['pages']),
+            '{}/page/{}.html'.format(base, (n // 7) % config['pages']),
+            '{}/report/{}.pdf'.format(base, n % config['reports'])
+        ]
+        return {'organic': [{'link': link} for link in links]}
+
+    CachedChatOpenAI.completion_with_retry = completion_with_retry
+    fake_embeddings = LatencyEmbeddings(latency=config['embed_latency'])
+    utils.embeddings.get_embeddings = lambda cache_dir=None, embeddings=None: get_embeddings(cache_dir, fake_embeddings)
+    gb.search_client.search = search
+
+    return gb
+
+
+def peak_rss_mb():
+    # ru_maxrss is KB on Linux, bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+
+    return round(own / 2**20, 1), round(children / 2**20, 1)
+
+
+def run_child(config):
+    """One blog run in this process. Prints its result as the last line."""
+    os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+    os.environ.setdefault('SERPER_API_KEY', 'benchmark')
+    gb = install_fakes(config)
+    from utils.tracing import tracer
+
+    with open(os.path.join(ROOT, 'outline.txt')) as f:
+        outline = f.read()
+    os.chdir(config['workdir'])
+    args = gb.get_arg_parser().parse_args(config['blogger_args'])
+
+    start = time.perf_counter()
+    gb.main(outline, args)
+    seconds = time.perf_counter() - start
+
+    stages = {}
+    for row in tracer.rows():
+        if row['seconds'] is not None:
+            stages.setdefault(row['stage'], []).append(row['seconds'])
+    sections = len(stages.get('section', []))
+    rss, children_rss = peak_rss_mb()
+
+    print('RESULT ' + json.dumps({
+        'sections': sections,
+        'seconds': round(seconds, 3),
+        'sections_per_min': round(sections / seconds * 60, 2),
+        'llm_calls': sum(group.get('llm_calls', 0) for group in tracer.summary('stage')),
+        'peak_rss_mb': rss,
+        'children_peak_rss_mb': children_rss,
+        'stages': {
+            stage: {
+                'n': len(values),
+                'p50': round(float(np.percentile(values, 50)), 3),
+                'p95': round(float(np.percentile(values, 95)), 3)
+            }
+            for stage, values in stages.items()
+        }
+    }))
+
+
+def git_commit():
+    def git(*args):
+        return subprocess.run(['git'] + list(args), cwd=ROOT, capture_output=True, text=True).stdout.strip()
+
+    return git('rev-parse', '--short', 'HEAD') or None, bool(git('status', '--porcelain', '--untracked-files=no'))
+
+
+def previous_result(path, entry):
+    """The latest recorded result of the same run and settings from another commit."""
+    if not os.path.exists(path):
+        return None
+
+    previous = None
+    with open(path) as f:
+        for line in f:
+            result = json.loads(line)
+            if result['run'] == entry['run'] and result['settings'] == entry['settings'] and result['commit'] != entry['commit']:
+                previous = result
+
+    return previous
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', nargs='+', default=list(RUNS), choices=list(RUNS))
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='Seconds per chat completion before its first token')
+    parser.add_argument('--token-latency', type=float, default=0.002, help='Seconds per completion token')
+    parser.add_argument('--embed-latency', type=float, default=0.1, help='Seconds per embeddings request')
+    parser.add_argument('--search-latency', type=float, default=0.3, help='Seconds per Serper search')
+    parser.add_argument('--page-latency', type=float, default=0.2, help='Seconds per fixture page request')
+    parser.add_argument('--pages', type=int, default=20, help='Distinct fixture HTML pages search results point at')
+    parser.add_argument('--reports', type=int, default=5, help='Distinct fixture PDF reports search results point at')
+    parser.add_argument('--pdf-pages', type=int, default=20)
+    parser.add_argument('--draft-words', type=int, default=150)
+    parser.add_argument('--search-mode', default='per-url', choices=['per-url', 'merged', 'direct'])
+    parser.add_argument('--blogger-args', nargs=argparse.REMAINDER, default=[],
+                        help='Passed on to GoldfinchBlogger, after the run settings')
+    parser.add_argument('--results', type=str, default=os.path.join(ROOT, 'benchmarks', 'results', 'pipeline.jsonl'),
+                        help='JSONL file each run is appended to')
+    parser.add_argument('--child', type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(json.loads(args.child))
+        sys.exit(0)
+
+    server = FixtureServer(delay=args.page_latency, pdf_pages=args.pdf_pages)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    settings = {
+        'llm_latency': args.llm_latency, 'token_latency': args.token_latency, 'embed_latency': args.embed_latency,
+        'search_latency': args.search_latency, 'page_latency': args.page_latency, 'pages': args.pages,
+        'reports': args.reports, 'pdf_pages': args.pdf_pages, 'draft_words': args.draft_words,
+        'search_mode': args.search_mode, 'blogger_args': args.blogger_args
+    }
+    commit, dirty = git_commit()
+    os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+
+    rows = []
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        cache_dir = os.path.join(root, 'cache')
+        for run in args.runs:
+            run_args, cold = RUNS[run]
+            if cold:
+                shutil.rmtree(cache_dir, ignore_errors=True)
+            workdir = os.path.join(root, run)
+            os.makedirs(workdir, exist_ok=True)
+
+            config = dict(settings, port=server.server_address[1], workdir=workdir, blogger_args=[
+                '--library-path', os.path.join(ROOT, 'vecstore_backup'), '--cache-dir', cache_dir,
+                '--search-mode', args.search_mode, '--llm-cache', 'all', '--temperature', '0'
+            ] + run_args + args.blogger_args)
+            child = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.pipeline', '--child', json.dumps(config)],
+                cwd=ROOT, capture_output=True, text=True
+            )
+            with open(os.path.join(root, '{}.log'.format(run)), 'w') as f:
+                f.write(child.stdout + child.stderr)
+            if child.returncode != 0 or not child.stdout.strip().splitlines()[-1].startswith('RESULT '):
+                print('{} failed:\n{}'.format(run, (child.stdout + child.stderr)[-3000:]))
+                continue
+
+            result = json.loads(child.stdout.strip().splitlines()[-1][len('RESULT '):])
+            results[run] = result
+            entry = {
+                'commit': commit, 'dirty': dirty, 'date': datetime.now().astimezone().isoformat(),
+                'run': run, 'settings': settings, **result
+            }
+            with open(args.results, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+            previous = previous_result(args.results, entry)
+            rows.append([
+                run, result['sections'], result['seconds'], result['sections_per_min'], result['llm_calls'],
+                result['peak_rss_mb'], result['children_peak_rss_mb'],
+                '{} ({})'.format(previous['sections_per_min'], previous['commit']) if previous else ''
+            ])
+
+    print(tabulate(rows, headers=['run', 'sections', 'seconds', 'sections/min', 'llm calls', 'peak RSS MB',
+                                  'children RSS MB', 'previous sections/min']))
+    print()
+
+    stages = list(dict.fromkeys(stage for result in results.values() for stage in result['stages']))
+    print(tabulate(
+        [[stage] + [
+            '{p50:.3f} / {p95:.3f}'.format(**result['stages'][stage]) if stage in result['stages'] else ''
+            for result in results.values()
+        ] for stage in stages],
+        headers=['stage p50 / p95 s'] + list(results)
+    ))
+    print()
+    print('{} commit {}{}, results appended to {}'.format(len(results), commit, ' (dirty)' if dirty else '', args.results))
@@ -0,0 +1,113 @@
+"""Server mode under load, with the fake backends from benchmarks.pipeline.
+
+Starts utils.server in this process against the fake chat model, embeddings,
+Serper stub and fixture pages, then `--clients` clients each submit a
+different outline at once, stream its events, and retry after the
+Retry-After of a 429 when the queue is full. Run for each `--max-jobs`.
+
+From goldfinch_blogger/: python -m benchmarks.server --clients 8 --max-jobs 1 4 --max-queued 2
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from tabulate import tabulate
+
+from benchmarks.pipeline import ROOT, FixtureServer, install_fakes
+
+
+def make_outline(outline, i):
+    # a different post per client, so one job's caches don't answer the next
+    return outline.replace('SECTION:\n', 'SECTION:\nPost {} angle {}. '.format(i, i * 7919))
+
+
+def submit(url, outline, max_wait=None):
+    """Submit one outline and follow its events to the end."""
+    start = time.perf_counter()
+    rejected = 0
+    while True:
+        r = requests.post(url + '/jobs?stream=1', data=outline.encode('utf-8'),
+                          headers={'Content-Type': 'text/plain'}, stream=True)
+        if r.status_code != 429:
+            break
+        rejected += 1
+        time.sleep(min(float(r.headers['Retry-After']), max_wait or float('inf')))
+
+    result = {'rejected': rejected, 'status': None, 'first_section': None}
+    for line in r.iter_lines():
+        event = json.loads(line)
+        if event['event'] == 'started':
+            result['waited'] = time.perf_counter() - start
+        if event['event'] == 'section' and result['first_section'] is None:
+            result['first_section'] = time.perf_counter() - start
+        if event['event'] in ('done', 'failed'):
+            result['status'] = event['event']
+    result['seconds'] = time.perf_counter() - start
+
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--max-jobs', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--max-queued', type=int, default=2)
+    parser.add_argument('--max-parallel-sections', type=int, default=8)
+    parser.add_argument('--max-retry-wait', type=float, default=None, help='Cap on the Retry-After clients honor')
+    parser.add_argument('--llm-latency', type=float, default=0.5)
+    parser.add_argument('--token-latency', type=float, default=0.002)
+    parser.add_argument('--embed-latency', type=float, default=0.1)
+    parser.add_argument('--search-latency', type=float, default=0.3)
+    parser.add_argument('--page-latency', type=float, default=0.2)
+    args = parser.parse_args()
+
+    os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+    os.environ.setdefault('SERPER_API_KEY', 'benchmark')
+    pages = FixtureServer(delay=args.page_latency)
+    threading.Thread(target=pages.serve_forever, daemon=True).start()
+    gb = install_fakes({
+        'llm_latency': args.llm_latency, 'token_latency': args.token_latency, 'embed_latency': args.embed_latency,
+        'search_latency': args.search_latency, 'pages': 20, 'reports': 5, 'draft_words': 150,
+        'port': pages.server_address[1]
+    })
+    from utils.server import JobServer
+
+    with open(os.path.join(ROOT, 'outline.txt')) as f:
+        outline = f.read()
+
+    rows = []
+    for max_jobs in args.max_jobs:
+        with tempfile.TemporaryDirectory() as root:
+            blogger_args = gb.get_arg_parser().parse_args([
+                '--library-path', os.path.join(ROOT, 'vecstore_backup'), '--cache-dir', os.path.join(root, 'cache'),
+                '--output_dir', root, '--max-parallel-sections', str(args.max_parallel_sections)
+            ])
+            server = JobServer(('127.0.0.1', 0), blogger_args, max_jobs=max_jobs, max_queued=args.max_queued)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.clients) as executor:
+                results = list(executor.map(
+                    lambda i: submit(url, make_outline(outline, i), args.max_retry_wait), range(args.clients)
+                ))
+            seconds = time.perf_counter() - start
+            server.stop()
+
+        latencies = [result['seconds'] for result in results]
+        first_sections = [result['first_section'] for result in results if result['first_section'] is not None]
+        rows.append([
+            max_jobs, sum(result['status'] == 'done' for result in results), round(seconds, 1),
+            round(len(results) / seconds * 60, 1), sum(result['rejected'] for result in results),
+            round(float(np.percentile(latencies, 50)), 1), round(float(np.percentile(latencies, 95)), 1),
+            round(float(np.percentile(first_sections, 50)), 1) if first_sections else None
+        ])
+
+    print(tabulate(rows, headers=['max jobs', 'done', 'seconds', 'jobs/min', '429s', 'p50 job s', 'p95 job s',
+                                  'p50 first section s']))
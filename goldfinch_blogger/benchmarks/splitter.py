@@ -0,0 +1,152 @@
+"""Check utils.splitter against the original chunking and time both.
+
+Then check overlap together with the max_tokens cap: no chunk goes over the
+cap, seeds stay within `overlap` tokens, and dropping the seeds gives back the
+text of the corpus.
+
+From goldfinch_blogger/: python -m benchmarks.splitter
+"""
+import re
+import sys
+import time
+import pathlib
+import argparse
+
+import tiktoken
+
+from utils.splitter import text_splitter, multi_page_text_splitter
+
+
+CORPUS = pathlib.Path(__file__).parent / 'fixtures' / 'corpus'
+
+
+# The splitters as they were before utils.splitter, re-encoding the whole chunk
+# after every sentence
+def legacy_text_splitter(text, n, tokenizer):
+    chunks = []
+    chunk = ''
+    sentences = [s.strip().replace('\n', ' ') for s in text.split('.')]
+    for s in sentences:
+        if chunk == '':
+            chunk = s
+        else:
+            chunk = chunk + ' ' + s
+
+        chunk_len = len(tokenizer.encode(chunk))
+        if chunk_len >= 0.9*n:
+            chunks.append(chunk)
+            chunk = ''
+
+    if chunk != '':
+        chunks.append(chunk)
+
+    return chunks
+
+
+def legacy_multi_page_text_splitter(pages, n, tokenizer):
+    chunks = []
+    page_nums = []
+    chunk = ''
+    for num, page in enumerate(pages):
+        sentences = [s.strip().replace('\n', ' ') for s in page.split('.')]
+        for s in sentences:
+            if chunk == '':
+                chunk = s
+            else:
+                chunk = chunk + ' ' + s
+
+            chunk_len = len(tokenizer.encode(chunk))
+            if chunk_len >= 0.9*n:
+                chunks.append(chunk)
+                page_nums.append(num+1)
+                chunk = ''
+
+    if chunk != '':
+        chunks.append(chunk)
+        page_nums.append(num+1)
+
+    return chunks, page_nums
+
+
+def check(tokenizer, sizes):
+    mismatches = 0
+    for path in sorted(CORPUS.glob('*.txt')):
+        text = path.read_text()
+        pages = text.split('\f')
+        for n in sizes:
+            same_text = text_splitter(text, n, tokenizer) == legacy_text_splitter(text, n, tokenizer)
+            same_pages = multi_page_text_splitter(pages, n, tokenizer) == legacy_multi_page_text_splitter(pages, n, tokenizer)
+            if not (same_text and same_pages):
+                mismatches += 1
+                print('MISMATCH {} n={} text={} pages={}'.format(path.name, n, same_text, same_pages))
+
+    return mismatches
+
+
+def tag_sentences(text):
+    # a unique marker at the start of every sentence shows where each chunk's seed ends
+    return '.'.join(
+        ' s{} {}'.format(i, sentence) if sentence.strip() else sentence
+        for i, sentence in enumerate(text.split('.'))
+    )
+
+
+def seed_length(prev, chunk):
+    # a seed is the sentences before chunk's first one that prev doesn't have
+    last = max(map(int, re.findall(r'\bs(\d+) ', prev)), default=-1)
+    new = next((m.start() for m in re.finditer(r'\bs(\d+) ', chunk) if int(m.group(1)) > last), len(chunk))
+    seed = chunk[:new].rstrip(' ')
+    return len(seed) if seed and prev.rstrip(' ').endswith(seed) else 0
+
+
+def check_overlap(tokenizer, sizes):
+    failures = seeded = total = 0
+    for path in sorted(CORPUS.glob('*.txt')):
+        text = tag_sentences(path.read_text())
+        for n in sizes:
+            for overlap in (n // 4, n // 2):
+                max_tokens = 2*n
+                chunks = text_splitter(text, n, tokenizer, overlap=overlap, max_tokens=max_tokens)
+                seeds = [0] + [seed_length(prev, chunk) for prev, chunk in zip(chunks, chunks[1:])]
+                over_cap = sum(len(tokenizer.encode(chunk)) > max_tokens for chunk in chunks)
+                over_overlap = sum(len(tokenizer.encode(chunk[:k])) > overlap for chunk, k in zip(chunks, seeds))
+                # whitespace aside, the chunks minus their seeds are the whole text
+                rest = ''.join(chunk[k:] for chunk, k in zip(chunks, seeds))
+                same = ''.join(rest.split()) == ''.join(text.replace('.', '').split())
+                seeded += sum(k > 0 for k in seeds)
+                total += len(chunks)
+                if over_cap or over_overlap or not same:
+                    failures += 1
+                    print('OVERLAP {} n={} overlap={}: {} over the cap, {} seeds over overlap, text kept={}'.format(
+                        path.name, n, overlap, over_cap, over_overlap, same
+                    ))
+    print('{} of {} chunks start with an overlap'.format(seeded, total))
+
+    return failures
+
+
+def bench(tokenizer, n, repeat):
+    text = '\n'.join(path.read_text() for path in sorted(CORPUS.glob('*.txt'))) * repeat
+    for fn in (legacy_text_splitter, text_splitter):
+        start = time.perf_counter()
+        chunks = fn(text, n, tokenizer)
+        print('{:<22} n={:<5} {:>6} chunks {:>8.3f}s'.format(fn.__name__, n, len(chunks), time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 100, 500, 2000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    tokenizer = tiktoken.get_encoding("cl100k_base")
+
+    mismatches = check(tokenizer, args.sizes)
+    print('{} mismatches against the original splitters'.format(mismatches))
+    overlap_failures = check_overlap(tokenizer, args.sizes)
+    print('{} overlap checks failed'.format(overlap_failures))
+
+    for n in (100, 1000):
+        bench(tokenizer, n, args.repeat)
+
+    sys.exit(1 if mismatches or overlap_failures else 0)
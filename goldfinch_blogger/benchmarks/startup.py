@@ -0,0 +1,100 @@
+"""CLI startup check: import time, heavy modules at import, and --help/--dry-run wall time.
+
+Imports each module in a fresh interpreter under `python -X importtime`. It fails
+(exit 1) when the import goes over `--budget-ms` or pulls in a heavy dependency
+that should only load once a run needs it.
+
+From goldfinch_blogger/: python -m benchmarks.startup --budget-ms 400
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+from tabulate import tabulate
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded by the functions that need them, never at import
+HEAVY = ['langchain', 'openai', 'faiss', 'numpy', 'tiktoken', 'selenium.webdriver', 'bs4', 'PyPDF2', 'weaviate',
+         'sqlalchemy', 'pydantic', 'tabulate']
+
+
+def import_times(module):
+    """{module: (self µs, cumulative µs)} for everything a fresh `import module` loads."""
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                         cwd=ROOT, capture_output=True, text=True, check=True)
+    times = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+
+    return times
+
+
+def heavy_imports(names):
+    return [heavy for heavy in HEAVY if any(name == heavy or name.startswith(heavy + '.') for name in names)]
+
+
+def wall_ms(cmd, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + cmd, cwd=ROOT, capture_output=True, check=True)
+        seconds.append(time.perf_counter() - start)
+
+    return statistics.median(seconds) * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', nargs='+',
+                        default=['GoldfinchBlogger', 'utils.server', 'utils.threatintel', 'utils.ingest', 'utils.crawl'])
+    parser.add_argument('--budget-ms', type=float, default=400,
+                        help='Max cumulative import time of each module')
+    parser.add_argument('--cli-budget-ms', type=float, default=1000,
+                        help='Max median wall time of --help and --dry-run, interpreter start included')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    failures = []
+    rows = []
+    for module in args.modules:
+        # the first run warms the bytecode and OS file caches
+        import_times(module)
+        runs = [import_times(module) for _ in range(args.repeat)]
+        ms = statistics.median(times[module][1] for times in runs) / 1000
+        heavy = heavy_imports(runs[-1])
+        slowest = sorted(runs[-1].items(), key=lambda item: item[1][0], reverse=True)[:3]
+        rows.append([module, ms, len(runs[-1]), ', '.join('{} {:.0f}'.format(name, t[0] / 1000) for name, t in slowest)])
+
+        if ms > args.budget_ms:
+            failures.append('import {} took {:.0f} ms, over the {:.0f} ms budget'.format(module, ms, args.budget_ms))
+        if heavy:
+            failures.append('import {} loads {}'.format(module, ', '.join(heavy)))
+
+    print(tabulate(rows, headers=['module', 'import ms', 'modules', 'slowest (self ms)'], floatfmt='.0f'))
+    print()
+
+    rows = []
+    for name, cmd in [
+        ('--help', ['GoldfinchBlogger.py', '--help']),
+        ('--dry-run', ['GoldfinchBlogger.py', '--outline_path', 'outline.txt', '--dry-run'])
+    ]:
+        ms = wall_ms(cmd, args.repeat)
+        rows.append([name, ms])
+        if ms > args.cli_budget_ms:
+            failures.append('{} took {:.0f} ms, over the {:.0f} ms budget'.format(name, ms, args.cli_budget_ms))
+    print(tabulate(rows, headers=['command', 'wall ms'], floatfmt='.0f'))
+    print()
+
+    for failure in failures:
+        print('FAIL ' + failure)
+    if failures:
+        sys.exit(1)
+    print('OK')
@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid', 'mc_cid', 'mc_eid')
+
+
+class OfflineCacheMiss(LookupError):
+    pass
+
+
+def hash_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def normalize_url(url):
+    scheme, netloc, path, query, _ = urlsplit(url.strip())
+    scheme = scheme.lower()
+    netloc = netloc.lower()
+    if (scheme, netloc.rsplit(':', 1)[-1]) in (('http', '80'), ('https', '443')):
+        netloc = netloc.rsplit(':', 1)[0]
+
+    if path != '/' and path.endswith('/'):
+        path = path.rstrip('/')
+    path = path or '/'
+
+    params = [
+        (k, v) for k, v in parse_qsl(query, keep_blank_values=True)
+        if not k.lower().startswith(TRACKING_PARAMS)
+    ]
+    query = urlencode(sorted(params))
+
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+
+class DiskCache():
+    """Persistent key/value store backed by sqlite.
+
+    Values are anything json serializable. Entries older than `max_age` seconds
+    are dropped, and once the stored size passes `max_bytes` the least recently
+    used entries are evicted.
+    """
+
+    def __init__(self, path, max_bytes=None, max_age=None):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'key TEXT PRIMARY KEY, value TEXT, size INTEGER, created REAL, accessed REAL)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)')
+
+
+    def get(self, key):
+        """Return {'value', 'created'} for `key`, or None."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, created FROM entries WHERE key = ?', (key,)
+            ).fetchone()
+
+            if row is not None and self.max_age is not None and now - row[1] > self.max_age:
+                with self._conn:
+                    self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            with self._conn:
+                self._conn.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+
+        return {'value': json.loads(row[0]), 'created': row[1]}
+
+
+    def set(self, key, value, size=None):
+        """Store `value` under `key`. Returns the values evicted to make room."""
+        with self._lock, self._conn:
+            self._set(key, value, size)
+            return [json.loads(value) for value in self._evict()]
+
+
+    def _set(self, key, value, size=None):
+        data = json.dumps(value)
+        size = size if size is not None else len(data)
+        now = time.time()
+        self._conn.execute(
+            'INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+            (key, data, size, now, now)
+        )
+
+
+    def touch(self, key):
+        with self._lock, self._conn:
+            now = time.time()
+            self._conn.execute('UPDATE entries SET created = ?, accessed = ? WHERE key = ?', (now, now, key))
+
+
+    def delete(self, key):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+
+    def values(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT value FROM entries').fetchall()
+
+        return [json.loads(row[0]) for row in rows]
+
+
+    def evict(self):
+        """Drop expired entries, then LRU entries until under max_bytes. Returns evicted values."""
+        with self._lock, self._conn:
+            return [json.loads(value) for value in self._evict()]
+
+
+    def _evict(self, column='value'):
+        # The caller holds the lock. Returns `column`, an SQL expression, of every evicted entry
+        evicted = []
+        if self.max_age is not None:
+            cutoff = time.time() - self.max_age
+            rows = self._conn.execute(
+                'SELECT {} FROM entries WHERE created < ?'.format(column), (cutoff,)
+            ).fetchall()
+            self._conn.execute('DELETE FROM entries WHERE created < ?', (cutoff,))
+            evicted.extend(value for value, in rows)
+
+        if self.max_bytes is not None:
+            total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total > self.max_bytes:
+                rows = self._conn.execute('SELECT key, {}, size FROM entries ORDER BY accessed'.format(column))
+                drop = []
+                for key, value, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    drop.append((key,))
+                    evicted.append(value)
+                    total -= size
+                self._conn.executemany('DELETE FROM entries WHERE key = ?', drop)
+
+        return evicted
+
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class PageCache(DiskCache):
+    """Scraped pages keyed by normalized url.
+
+    Raw bytes live in content-addressed blob files (so mirrors of the same page
+    share storage), the sqlite index holds the extracted text and fetch metadata
+    (etag, last-modified, content type, tier). Entries older than `ttl` are
+    stale: they can still be revalidated or served in offline mode.
+    """
+
+    def __init__(self, root, ttl=7*24*3600, max_bytes=500*1024*1024, offline=False):
+        super().__init__(os.path.join(root, 'index.sqlite'), max_bytes=max_bytes)
+        self.root = root
+        self.ttl = ttl
+        self.offline = offline
+        with self._conn:
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_sha ON entries(json_extract(value, '$.sha'))"
+            )
+
+
+    def blob_path(self, sha):
+        return os.path.join(self.root, 'blobs', sha[:2], sha)
+
+
+    def lookup(self, url):
+        """Return the cached page for `url`, with 'fresh' set if it's within the ttl."""
+        entry = self.get(normalize_url(url))
+        if entry is None:
+            return None
+
+        page = entry['value']
+        try:
+            with open(self.blob_path(page['sha']), 'rb') as f:
+                page['content'] = f.read()
+        except FileNotFoundError:
+            self.delete(normalize_url(url))
+            return None
+
+        page['fresh'] = time.time() - entry['created'] < self.ttl
+
+        return page
+
+
+    def write_blob(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(tmp, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+
+    def put(self, url, content, meta=None, text=None):
+        sha = hashlib.sha256(content).hexdigest()
+        path = self.blob_path(sha)
+        if not os.path.exists(path):
+            self.write_blob(path, content)
+
+        page = {'url': url, 'sha': sha, 'bytes': len(content), 'text': text, 'meta': meta or {}}
+        with self._lock, self._conn:
+            self._set(normalize_url(url), page, size=len(content) + len(text or ''))
+            # another put may have removed the blob before this entry referenced it
+            if not os.path.exists(path):
+                self.write_blob(path, content)
+
+            # only the evicted pages' blobs can have become orphans
+            for old_sha in set(self._evict("json_extract(value, '$.sha')")):
+                if not self.is_referenced(old_sha):
+                    try:
+                        os.remove(self.blob_path(old_sha))
+                    except FileNotFoundError:
+                        pass
+
+
+    def is_referenced(self, sha):
+        # The caller holds the lock
+        return self._conn.execute(
+            "SELECT 1 FROM entries WHERE json_extract(value, '$.sha') = ? LIMIT 1", (sha,)
+        ).fetchone() is not None
+
+
+    def set_text(self, url, text):
+        # Keep the entry's age, only the extracted text is new
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE entries SET value = json_set(value, '$.text', ?), "
+                "size = json_extract(value, '$.bytes') + ? WHERE key = ?",
+                (text, len(text), normalize_url(url))
+            )
+
+
+    def revalidated(self, url):
+        self.touch(normalize_url(url))
+
@@ -0,0 +1,203 @@
+"""Poll every threat intel source at once and save their new posts as JSON reports.
+
+Sources are the Scraper subclasses with a `source` set. Each source's listing
+pages are read once for every post since its watermark, and those posts are
+fetched in parallel. Sources share the scrapers' driver pool, and their
+requests are spaced out per host. The DataSource watermarks are read in one
+Weaviate query, and each is written back once all of that source's new posts
+are saved (and loaded, with --load).
+
+From goldfinch_blogger/: python -m utils.crawl --out-dir reports/new --load
+"""
+import os
+import re
+import json
+import time
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from utils import scrapers
+from utils.scrapers.base import driver_pool, fetcher
+from utils.scrapers.fetch import DomainLimiter
+from utils.threatintel import get_or_create_sources, update_sources, last_post_date
+
+
+def report_path(out_dir, source, post):
+    slug = re.sub(r'[^A-Za-z0-9_-]+', '-', post['url'].rstrip('/').rsplit('/', 1)[-1])[:80]
+    return os.path.join(out_dir, '{}_{}_{}.json'.format(source, post['date'].strftime('%Y%m%d'), slug))
+
+
+def save_report(path, report):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp, path)
+
+
+def failed_posts(entry, failures=()):
+    """Posts that weren't saved, or whose report is in `failures` (ingest_reports' stats)."""
+    return [post for post in entry['posts'] if 'error' in post or post['path'] in failures]
+
+
+def scrape_new_post(scraper_cls, source, post, out_dir):
+    # one scraper per post, since a scraper keeps the post it's on
+    scraper = scraper_cls()
+    scraper.new_post_url = post['url']
+    scraper.new_post_title = post['title']
+    scraper.new_post_date = post['date']
+    scraper.new_post_author = post['author']
+    content = scraper.scrape_post()
+
+    path = report_path(out_dir, source, post)
+    save_report(path, {
+        'source': source,
+        'content': content,
+        'date': post['date'].isoformat(),
+        'title': post['title'],
+        'author': post['author'],
+        'url': post['url']
+    })
+
+    return path
+
+
+def poll_source(config, since, out_dir, max_pages=5, max_parallel_posts=4):
+    """Save every post of one source newer than `since`. Returns its run report entry."""
+    start = time.monotonic()
+    entry = {'source': config['source'], 'scraper': config['scraper'], 'since': since.isoformat(), 'posts': []}
+    try:
+        scraper_cls = scrapers.scraper_classes()[config['scraper']]
+        # one pass over the listing pages finds everything since the last run
+        scraper = scraper_cls()
+        posts = scraper.get_new_posts(since, max_pages=max_pages)
+
+        with ThreadPoolExecutor(max_workers=max(1, max_parallel_posts)) as executor:
+            futures = [executor.submit(scrape_new_post, scraper_cls, config['source'], post, out_dir) for post in posts]
+            for post, future in zip(posts, futures):
+                try:
+                    entry['posts'].append({'url': post['url'], 'path': future.result()})
+                except Exception as e:
+                    print('Issue with {}: {}'.format(post['url'], e))
+                    entry['posts'].append({'url': post['url'], 'error': repr(e)})
+
+        failed = failed_posts(entry)
+        if failed:
+            entry.update(status='error', error='{} of {} posts failed'.format(len(failed), len(posts)))
+        elif scraper.truncated:
+            # the posts past the last page read are older than these, so the watermark has to stay
+            entry.update(status='error', error='more than {} listing pages of new posts, rerun with a higher '
+                                               '--max-pages'.format(max_pages))
+        elif posts:
+            entry.update(status='new', date=max(post['date'] for post in posts))
+        else:
+            entry['status'] = 'unchanged'
+    except Exception as e:
+        print('Issue with {}: {}'.format(config['source'], e))
+        entry.update(status='error', error=repr(e))
+
+    entry['seconds'] = round(time.monotonic() - start, 3)
+    return entry
+
+
+def crawl(configs, wv_client, out_dir, max_workers=8, loader=None, manifest=None, max_pages=5, max_parallel_posts=4):
+    """Poll `configs` concurrently. A source's watermark only moves once all its new posts are saved/loaded."""
+    start = time.monotonic()
+    os.makedirs(out_dir, exist_ok=True)
+    sources = get_or_create_sources(configs, wv_client)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        entries = list(executor.map(
+            lambda config: poll_source(
+                config, last_post_date(sources[config['source']]), out_dir,
+                max_pages=max_pages, max_parallel_posts=max_parallel_posts
+            ),
+            configs
+        ))
+
+    new = [entry for entry in entries if entry['status'] == 'new']
+    if loader is not None and new:
+        from utils.ingest import ingest_reports
+
+        stats = ingest_reports([post['path'] for entry in new for post in entry['posts']], loader, manifest=manifest)
+        for entry in new:
+            failed = failed_posts(entry, stats['failures'])
+            if failed:
+                entry.update(status='error', error='{} of {} posts failed to load'.format(len(failed), len(entry['posts'])))
+
+    # Only sources whose new posts all made it move forward
+    latest = {entry['source']: entry['date'] for entry in new if entry['status'] == 'new'}
+    unsaved = update_sources(sources, latest, wv_client) if latest else {}
+    for entry in new:
+        entry.pop('date')
+        if entry['source'] in unsaved:
+            entry.update(status='error', error='watermark not saved: {}'.format(unsaved[entry['source']]))
+
+    return {
+        'started': datetime.now().astimezone().isoformat(),
+        'seconds': round(time.monotonic() - start, 3),
+        'slowest': max((entry['seconds'] for entry in entries), default=0),
+        'posts': sum(len(entry['posts']) for entry in entries),
+        'sources': entries
+    }
+
+
+def print_report(report):
+    for entry in report['sources']:
+        print('{:<32} {:<10} {:>3} posts {:>7.2f}s  {}'.format(
+            entry['source'], entry['status'], len(entry['posts']), entry['seconds'], entry.get('error') or ''
+        ))
+    counts = {}
+    for entry in report['sources']:
+        counts[entry['status']] = counts.get(entry['status'], 0) + 1
+    print('{} sources, {} posts in {:.1f}s (slowest source {:.1f}s): {}'.format(
+        len(report['sources']), report['posts'], report['seconds'], report['slowest'], counts
+    ))
+
+
+def get_arg_parser():
+    parser = argparse.ArgumentParser(description='Poll all threat intel sources for new posts.')
+    parser.add_argument('--sources', nargs='+', help='Only these sources (default: every scraper with a source)')
+    parser.add_argument('--out-dir', type=str, default='reports/new', help='Where new posts are saved as JSON reports')
+    parser.add_argument('--max-parallel-sources', type=int, default=8, help='Sources polled at once')
+    parser.add_argument('--max-pages', type=int, default=5, help='Listing pages followed per source when catching up')
+    parser.add_argument('--max-parallel-posts', type=int, default=4, help='New posts of one source fetched at once')
+    parser.add_argument('--max-per-domain', type=int, default=2, help='Requests in flight per host')
+    parser.add_argument('--domain-delay', type=float, default=1.0, help='Seconds between request starts per host')
+    parser.add_argument('--driver-pool-size', type=int, default=3, help='Headless Chrome browsers shared by all sources')
+    parser.add_argument('--load', action='store_true', help='Load new posts into Weaviate before moving watermarks')
+    parser.add_argument('--cache-dir', type=str, default='cache', help='Ingest manifest location, with --load')
+    parser.add_argument('--report', type=str, default=None,
+                        help='Run report path (default: crawl_report.json in --out-dir)')
+
+    return parser
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    args = get_arg_parser().parse_args()
+
+    from utils.ingest import get_client
+    from utils.threatintel import BatchLoader, IngestManifest
+
+    driver_pool.configure(size=args.driver_pool_size)
+    fetcher.politeness = DomainLimiter(max_per_domain=args.max_per_domain, delay=args.domain_delay)
+
+    configs = list(scrapers.source_configs().values())
+    if args.sources:
+        configs = [config for config in configs if config['source'] in args.sources]
+
+    wv_client = get_client()
+    loader = manifest = None
+    if args.load:
+        loader = BatchLoader(wv_client)
+        manifest = IngestManifest(os.path.join(args.cache_dir, 'ingest.sqlite'))
+
+    report = crawl(
+        configs, wv_client, args.out_dir, max_workers=args.max_parallel_sources, loader=loader, manifest=manifest,
+        max_pages=args.max_pages, max_parallel_posts=args.max_parallel_posts
+    )
+    print_report(report)
+    save_report(args.report or os.path.join(args.out_dir, 'crawl_report.json'), report)
@@ -0,0 +1,176 @@
+import os
+import re
+import json
+import sqlite3
+import hashlib
+import threading
+from typing import List
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from utils.tracing import tracer, count_tokens, price
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class EmbeddingStore():
+    """Embedding vectors for one model, keyed by chunk hash.
+
+    Vectors are appended to a flat float32 file that is read back through
+    np.memmap; a sqlite index maps each key to its row.
+    """
+
+    def __init__(self, root, model):
+        self.model = model
+        self.dir = os.path.join(root, re.sub(r'[^A-Za-z0-9_.-]+', '_', model))
+        os.makedirs(self.dir, exist_ok=True)
+        self.vectors_path = os.path.join(self.dir, 'vectors.f32')
+        self.meta_path = os.path.join(self.dir, 'meta.json')
+
+        self.dim = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.dim = json.load(f)['dim']
+
+        self._lock = threading.Lock()
+        self._mmap = None
+        self._conn = sqlite3.connect(os.path.join(self.dir, 'index.sqlite'), timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, row INTEGER)')
+
+
+    def get_many(self, keys):
+        rows = {}
+        keys = list(keys)
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i+500]
+                rows.update(self._conn.execute(
+                    'SELECT key, row FROM vectors WHERE key IN ({})'.format(','.join('?'*len(batch))),
+                    batch
+                ).fetchall())
+
+            if not rows:
+                return {}
+            vectors = self._map(max(rows.values()) + 1)
+
+            return {key: np.array(vectors[row]) for key, row in rows.items()}
+
+
+    def put_many(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self.meta_path, 'w') as f:
+                    json.dump({'model': self.model, 'dim': self.dim}, f)
+            if vectors.shape[1] != self.dim:
+                raise ValueError('Expected {}-d vectors for {}, got {}'.format(self.dim, self.model, vectors.shape[1]))
+
+            with open(self.vectors_path, 'ab') as f:
+                # other processes may be appending to the same store
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0, os.SEEK_END)
+                    start = f.tell() // (4*self.dim)
+                    f.write(vectors.tobytes())
+                    f.flush()
+                finally:
+                    if fcntl:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+            with self._conn:
+                self._conn.executemany(
+                    'INSERT OR IGNORE INTO vectors (key, row) VALUES (?, ?)',
+                    [(key, start + i) for i, key in enumerate(keys)]
+                )
+
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM vectors').fetchone()[0]
+
+
+    def _map(self, min_rows):
+        if self._mmap is None or self._mmap.shape[0] < min_rows:
+            n_rows = os.path.getsize(self.vectors_path) // (4*self.dim)
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(n_rows, self.dim))
+
+        return self._mmap
+
+
+class CachedEmbeddings(Embeddings):
+    """Wrap an Embeddings model so only chunks it hasn't seen go to the API."""
+
+    def __init__(self, embeddings, store):
+        self.embeddings = embeddings
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with tracer.span('embed'):
+            keys = [chunk_hash(text) for text in texts]
+            found = self.store.get_many(set(keys))
+
+            # one batched request for everything that's missing
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in found:
+                    missing.setdefault(key, text)
+
+            if missing:
+                vectors = self.embeddings.embed_documents(list(missing.values()))
+                self.store.put_many(list(missing), vectors)
+                found.update(zip(missing, np.asarray(vectors, dtype=np.float32)))
+
+                tokens = count_tokens(missing.values())
+                tracer.add(embedding_tokens=tokens, cost=price(self.store.model, tokens))
+            tracer.add(embedded=len(missing), embedding_cache_hits=len(texts) - len(missing))
+
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        return [found[key].tolist() for key in keys]
+
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+def chunk_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+_cached = {}
+_cached_lock = threading.Lock()
+
+
+def get_embeddings(cache_dir='cache', embeddings=None):
+    """OpenAIEmbeddings behind a persistent cache, one per cache_dir and model."""
+    if embeddings is None:
+        from langchain.embeddings.openai import OpenAIEmbeddings
+        embeddings = OpenAIEmbeddings()
+    if cache_dir is None:
+        return embeddings
+
+    model = getattr(embeddings, 'model', type(embeddings).__name__)
+    with _cached_lock:
+        key = (os.path.abspath(cache_dir), model)
+        if key not in _cached:
+            store = EmbeddingStore(os.path.join(cache_dir, 'embeddings'), model)
+            _cached[key] = CachedEmbeddings(embeddings, store)
+
+    return _cached[key]
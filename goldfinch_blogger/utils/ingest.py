@@ -0,0 +1,170 @@
+"""Load a directory of threat intel reports (PDF and JSON) into Weaviate.
+
+Reports are read and chunked across a process pool while the chunks of the
+ones already done stream into one shared Weaviate batch. Reports and chunks
+recorded in the ingest manifest are skipped before any parsing or embedding.
+
+From goldfinch_blogger/: python -m utils.ingest path/to/reports --workers 4 --batch-size 100
+"""
+import os
+import time
+import pathlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+from utils.pdf import process_context
+from utils.threatintel import (
+    BatchLoader,
+    IngestManifest,
+    read_threatintel_report,
+    add_threatintel_report,
+    file_hash,
+    known_uuids,
+    report_uuids,
+    record_report,
+)
+
+
+def find_reports(root):
+    return sorted(
+        path for path in pathlib.Path(root).rglob('*')
+        if path.is_file() and path.suffix.lower() in ('.pdf', '.json')
+    )
+
+
+def ingest_reports(paths, loader, chunk_size=100, workers=1, embeddings=None, manifest=None, check_weaviate=False,
+                   record_every=20):
+    """Read, chunk and batch-load reports, returning counts, failures and seconds taken."""
+    start = time.perf_counter()
+    stats = {'reports': 0, 'chunks': 0, 'skipped_reports': 0, 'skipped_objects': 0, 'failures': {}}
+
+    hashes = {}
+    if manifest:
+        for path in paths:
+            hashes[path] = file_hash(path)
+        paths = [path for path in paths if not manifest.has_report(hashes[path])]
+        stats['skipped_reports'] = len(hashes) - len(paths)
+
+    pending = []
+    loaded = {}
+
+    def record():
+        # only what a flush has confirmed goes into the manifest
+        loader.flush()
+        for args in pending:
+            record_report(manifest, loader, *args)
+        pending.clear()
+
+    def add(path, report):
+        chunks, pages, meta = report
+        known = known_uuids(chunks, meta, manifest, loader.wv_client if check_weaviate else None)
+        report_uuid, added = add_threatintel_report(loader, chunks, pages, meta, embeddings, known=known)
+        chunk_uuids = report_uuids(chunks, meta)[0]
+        loaded[str(path)] = set(map(str, chunk_uuids + [report_uuid]))
+        stats['reports'] += 1
+        stats['chunks'] += len(chunks)
+        stats['skipped_objects'] += len(chunks) + 1 - len(added)
+
+        if manifest:
+            pending.append((hashes[path], path, chunk_uuids, report_uuid))
+            if len(pending) >= record_every:
+                record()
+
+    if workers <= 1:
+        for path in paths:
+            try:
+                add(path, read_threatintel_report(str(path), chunk_size))
+            except Exception as e:
+                print('Issue with {}: {}'.format(path, e))
+                stats['failures'][str(path)] = str(e)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=process_context()) as executor:
+            futures = {executor.submit(read_threatintel_report, str(path), chunk_size): path for path in paths}
+            for future in as_completed(futures):
+                try:
+                    add(futures[future], future.result())
+                except Exception as e:
+                    print('Issue with {}: {}'.format(futures[future], e))
+                    stats['failures'][str(futures[future])] = str(e)
+
+    if manifest:
+        record()
+    else:
+        loader.flush()
+
+    # objects or references the batch turned away leave their report incomplete
+    for path, uuids in loaded.items():
+        rejected = uuids & loader.failed_ids
+        if rejected:
+            print('Issue with {}: Weaviate rejected {} of its objects'.format(path, len(rejected)))
+            stats['failures'][path] = 'Weaviate rejected {} objects'.format(len(rejected))
+    stats['seconds'] = time.perf_counter() - start
+
+    return stats
+
+
+def print_stats(stats, loader):
+    seconds = stats['seconds']
+    print('{} reports, {} chunks in {:.1f}s'.format(stats['reports'], stats['chunks'], seconds))
+    print('Skipped {} known reports and {} known objects'.format(stats['skipped_reports'], stats['skipped_objects']))
+    print('{} objects ({:.1f}/s), {} references ({:.1f}/s)'.format(
+        loader.objects, loader.objects / seconds, loader.references, loader.references / seconds
+    ))
+    if loader.errors:
+        print('{} batch errors, first: {}'.format(len(loader.errors), loader.errors[0]))
+    if stats['failures']:
+        print('{} reports failed: {}'.format(len(stats['failures']), ', '.join(stats['failures'])))
+
+
+def get_client():
+    import weaviate as wv
+
+    return wv.Client(
+        url=os.getenv('WEAVIATE_URL'),
+        auth_client_secret=wv.AuthApiKey(api_key=os.getenv('WEAVIATE_API_KEY')),
+        additional_headers={'X-OpenAI-Api-Key': os.getenv('OPENAI_API_KEY')}
+    )
+
+
+def get_arg_parser():
+    parser = argparse.ArgumentParser(description='Load a directory of threat intel reports into Weaviate.')
+    parser.add_argument('reports', help='Directory searched recursively for .pdf and .json reports')
+    parser.add_argument('--chunk-size', type=int, default=100, help='Tokens per chunk')
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1),
+                        help='Processes reading and chunking reports')
+    parser.add_argument('--batch-size', type=int, default=100, help='Objects per Weaviate batch request')
+    parser.add_argument('--batch-workers', type=int, default=2, help='Concurrent Weaviate batch requests')
+    parser.add_argument('--no-dynamic', action='store_true', help='Keep the batch size fixed')
+    parser.add_argument('--embed', action='store_true',
+                        help='Embed chunks here, through the embedding cache, instead of in Weaviate')
+    parser.add_argument('--cache-dir', type=str, default='cache', help='Embedding cache and ingest manifest location')
+    parser.add_argument('--no-manifest', action='store_true',
+                        help="Don't skip reports and chunks recorded in cache/ingest.sqlite")
+    parser.add_argument('--check-weaviate', action='store_true',
+                        help='Also ask Weaviate which chunks it already has before loading them')
+
+    return parser
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    args = get_arg_parser().parse_args()
+
+    embeddings = None
+    if args.embed:
+        from utils.embeddings import get_embeddings
+        embeddings = get_embeddings(args.cache_dir)
+
+    loader = BatchLoader(get_client(), batch_size=args.batch_size, num_workers=args.batch_workers, dynamic=not args.no_dynamic)
+    paths = find_reports(args.reports)
+    print('Found {} reports'.format(len(paths)))
+
+    manifest = None if args.no_manifest else IngestManifest(os.path.join(args.cache_dir, 'ingest.sqlite'))
+
+    stats = ingest_reports(
+        paths, loader, chunk_size=args.chunk_size, workers=args.workers, embeddings=embeddings,
+        manifest=manifest, check_weaviate=args.check_weaviate
+    )
+    print_stats(stats, loader)
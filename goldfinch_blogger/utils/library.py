@@ -0,0 +1,380 @@
+"""The library vector store behind get_library_retriever.
+
+A library folder holds `index.faiss` and either the original langchain
+`index.pkl` or, for libraries built here, `docs.sqlite` (one row per index
+row) plus `library.json` with the index type and search parameters.
+
+Indexes are opened memory-mapped, so worker processes share one copy in the
+page cache, and each folder is opened once per process.
+
+From goldfinch_blogger/:
+    python -m utils.library build --corpus chunks.jsonl --out vecstore_backup --index hnsw
+    python -m utils.library build --from vecstore_backup --out vecstore_backup --index ivf
+    python -m utils.library bench --from vecstore_backup --k 4
+"""
+import os
+import json
+import time
+import pickle
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+import numpy as np
+import faiss
+from langchain.docstore.base import Docstore
+from langchain.docstore.document import Document
+from langchain.vectorstores import FAISS
+
+
+INDEX_TYPES = ['flat', 'ivf', 'hnsw', 'pq']
+
+
+class SqliteDocstore(Docstore):
+    """Library chunks read from sqlite one at a time, instead of unpickled all at once."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect('file:{}?mode=ro'.format(path), uri=True, check_same_thread=False)
+
+
+    def search(self, search):
+        with self._lock:
+            row = self._conn.execute('SELECT text, metadata FROM docs WHERE id = ?', (int(search),)).fetchone()
+        if row is None:
+            return 'ID {} not found.'.format(search)
+
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+
+    @staticmethod
+    def write(path, docs):
+        conn = sqlite3.connect(path)
+        with conn:
+            conn.execute('CREATE TABLE docs (id INTEGER PRIMARY KEY, text TEXT, metadata TEXT)')
+            conn.executemany(
+                'INSERT INTO docs (id, text, metadata) VALUES (?, ?, ?)',
+                ((i, doc.page_content, json.dumps(doc.metadata)) for i, doc in enumerate(docs))
+            )
+        conn.close()
+
+
+class RowIds():
+    """index_to_docstore_id for a SqliteDocstore, where ids are index rows."""
+
+    def __init__(self, count):
+        self.count = count
+
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.count:
+            raise KeyError(i)
+        return int(i)
+
+
+    def __len__(self):
+        return self.count
+
+
+def default_nlist(n):
+    # ~4*sqrt(n) lists, with enough points per list to train the centroids
+    return int(max(1, min(4 * np.sqrt(n), n // 39)))
+
+
+def index_spec(index_type, n, dim, nlist=None, hnsw_m=32, pq_m=None):
+    if index_type == 'flat':
+        return 'Flat'
+    if index_type == 'hnsw':
+        return 'HNSW{}'.format(hnsw_m)
+
+    nlist = nlist or default_nlist(n)
+    if index_type == 'ivf':
+        return 'IVF{},Flat'.format(nlist)
+    if index_type == 'pq':
+        # 16-d sub-vectors by default: 96 bytes per 1536-d OpenAI vector
+        pq_m = pq_m or next(m for m in range(max(1, dim // 16), 0, -1) if dim % m == 0)
+        # 8-bit codebooks want ~10k training points
+        nbits = int(min(8, max(1, np.log2(max(2, n // 39)))))
+        return 'IVF{},PQ{}x{}'.format(nlist, pq_m, nbits)
+
+    raise ValueError('Unknown index type {!r}, expected one of {}'.format(index_type, INDEX_TYPES))
+
+
+def build_index(vectors, index_type='flat', nlist=None, hnsw_m=32, pq_m=None, max_train=100000, batch_size=10000):
+    n, dim = vectors.shape
+    spec = index_spec(index_type, n, dim, nlist=nlist, hnsw_m=hnsw_m, pq_m=pq_m)
+    index = faiss.index_factory(dim, spec)
+
+    if not index.is_trained:
+        rows = np.sort(np.random.default_rng(0).choice(n, min(n, max_train), replace=False))
+        index.train(np.ascontiguousarray(vectors[rows], dtype=np.float32))
+    # vectors may be a memmap, so add them a batch at a time
+    for i in range(0, n, batch_size):
+        index.add(np.ascontiguousarray(vectors[i:i+batch_size], dtype=np.float32))
+
+    return index, spec
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    params = faiss.ParameterSpace()
+    if nprobe and faiss.try_extract_index_ivf(index) is not None:
+        params.set_index_parameter(index, 'nprobe', nprobe)
+    if ef_search and hasattr(faiss.downcast_index(index), 'hnsw'):
+        params.set_index_parameter(index, 'efSearch', ef_search)
+
+
+def read_index(path, mmap=True):
+    if mmap:
+        # IFC maps flat codes (flat, HNSW, IVF); MMAP maps IVF lists on older faiss
+        for flag in ('IO_FLAG_MMAP_IFC', 'IO_FLAG_MMAP'):
+            if hasattr(faiss, flag):
+                try:
+                    return faiss.read_index(path, getattr(faiss, flag) | faiss.IO_FLAG_READ_ONLY)
+                except RuntimeError:
+                    pass
+
+    return faiss.read_index(path)
+
+
+def read_library(folder, mmap=True):
+    """Return (index, docstore, index_to_docstore_id, config) for a library folder."""
+    index = read_index(os.path.join(folder, 'index.faiss'), mmap=mmap)
+
+    config = {}
+    config_path = os.path.join(folder, 'library.json')
+    if os.path.exists(config_path):
+        with open(config_path) as f:
+            config = json.load(f)
+
+    if os.path.exists(os.path.join(folder, 'docs.sqlite')):
+        docstore = SqliteDocstore(os.path.join(folder, 'docs.sqlite'))
+        ids = RowIds(index.ntotal)
+    else:
+        with open(os.path.join(folder, 'index.pkl'), 'rb') as f:
+            docstore, ids = pickle.load(f)
+
+    set_search_params(index, config.get('nprobe'), config.get('ef_search'))
+    return index, docstore, ids, config
+
+
+_opened = {}
+_opened_lock = threading.Lock()
+
+
+def open_library(folder, embeddings, mmap=True):
+    """A langchain FAISS store over the library in `folder`, opened once per process."""
+    path = os.path.abspath(folder)
+    key = (path, os.stat(os.path.join(path, 'index.faiss')).st_mtime_ns, mmap)
+    with _opened_lock:
+        if key not in _opened:
+            _opened[key] = read_library(path, mmap=mmap)
+    index, docstore, ids, config = _opened[key]
+
+    return FAISS(embeddings.embed_query, index, docstore, ids)
+
+
+def search_many(db, embeddings, queries, k=4):
+    """Library hits for several queries, from one embeddings request and one index search.
+
+    A chunk hit by more than one query is kept only for the query it's closest to.
+    Returns {query: [Document]}, closest first.
+    """
+    vectors = np.asarray(embeddings.embed_documents(list(queries)), dtype=np.float32)
+    scores, rows = db.index.search(vectors, k)
+
+    best = {}
+    for q, (q_scores, q_rows) in enumerate(zip(scores, rows)):
+        for score, row in zip(q_scores, q_rows):
+            if row != -1 and (row not in best or score < best[row][0]):
+                best[row] = (score, q)
+
+    hits = {query: [] for query in queries}
+    for row, (score, q) in sorted(best.items(), key=lambda item: item[1][0]):
+        hits[queries[q]].append(db.docstore.search(db.index_to_docstore_id[row]))
+
+    return hits
+
+
+def iter_library_docs(docstore, ids):
+    for i in range(len(ids)):
+        yield docstore.search(ids[i])
+
+
+def library_vectors(index):
+    """The stored vectors, for rebuilding a library as another index type."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        if 'PQ' in type(faiss.downcast_index(ivf)).__name__:
+            raise ValueError('PQ libraries only store compressed vectors, rebuild from --corpus instead')
+        ivf.make_direct_map()
+
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def read_corpus(path):
+    """Documents from a JSONL chunk corpus: {"text": ..., "metadata": {...}} per line."""
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                chunk = json.loads(line)
+                yield Document(page_content=chunk['text'], metadata=chunk.get('metadata', {}))
+
+
+def embed_docs(docs, embeddings, out_path, batch_size=1000):
+    """Embed docs in batches into a float32 memmap at out_path."""
+    vectors = None
+    for i in range(0, len(docs), batch_size):
+        batch = np.asarray(embeddings.embed_documents([doc.page_content for doc in docs[i:i+batch_size]]), dtype=np.float32)
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.float32, shape=(len(docs), batch.shape[1]))
+        vectors[i:i+len(batch)] = batch
+        print('Embedded {}/{} chunks'.format(min(i + batch_size, len(docs)), len(docs)))
+
+    return vectors
+
+
+def save_library(folder, index, docs, config):
+    # Build next to the target and swap it in, so readers never see half a library
+    tmp = folder.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    faiss.write_index(index, os.path.join(tmp, 'index.faiss'))
+    SqliteDocstore.write(os.path.join(tmp, 'docs.sqlite'), docs)
+    with open(os.path.join(tmp, 'library.json'), 'w') as f:
+        json.dump(config, f, indent=2)
+
+    old = folder.rstrip('/') + '.old'
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(folder):
+        os.rename(folder, old)
+    os.rename(tmp, folder)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def load_source(args, workdir):
+    """Documents and vectors from --corpus (embedded) or an existing library (--from)."""
+    if args.corpus:
+        from utils.embeddings import get_embeddings
+
+        docs = list(read_corpus(args.corpus))
+        embeddings = get_embeddings(None if args.no_embedding_cache else args.cache_dir)
+        return docs, embed_docs(docs, embeddings, os.path.join(workdir, 'vectors.npy'))
+
+    index, docstore, ids, _ = read_library(args.source, mmap=False)
+    return list(iter_library_docs(docstore, ids)), library_vectors(index)
+
+
+def percentile_ms(seconds, q):
+    return 1000 * float(np.percentile(seconds, q))
+
+
+def evaluate(vectors, queries, index_types, k=4, nprobe=16, ef_search=64, **build_kwargs):
+    """Recall@k against exact search, and single-query latency, for each index type."""
+    exact, _ = build_index(vectors, 'flat')
+    _, truth = exact.search(queries, k)
+
+    rows = []
+    for index_type in index_types:
+        start = time.perf_counter()
+        index, spec = build_index(vectors, index_type, **build_kwargs)
+        build_seconds = time.perf_counter() - start
+        set_search_params(index, nprobe, ef_search)
+
+        found, latencies = [], []
+        for query in queries:
+            start = time.perf_counter()
+            _, rows_found = index.search(query[None, :], k)
+            latencies.append(time.perf_counter() - start)
+            found.append(rows_found[0])
+
+        recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+        rows.append({
+            'index': index_type,
+            'spec': spec,
+            'recall': recall,
+            'p50_ms': percentile_ms(latencies, 50),
+            'p95_ms': percentile_ms(latencies, 95),
+            'build_s': build_seconds,
+            'size_mb': faiss.serialize_index(index).nbytes / 1e6
+        })
+
+    return rows
+
+
+def print_rows(rows):
+    print('{:<6} {:<20} {:>9} {:>9} {:>9} {:>9} {:>9}'.format('index', 'spec', 'recall@k', 'p50 ms', 'p95 ms', 'build s', 'size MB'))
+    for row in rows:
+        print('{index:<6} {spec:<20} {recall:>9.3f} {p50_ms:>9.3f} {p95_ms:>9.3f} {build_s:>9.2f} {size_mb:>9.1f}'.format(**row))
+
+
+def sample_queries(vectors, n, noise=0.01, seed=0):
+    # Stored chunks, nudged off their own vectors, stand in for real questions
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(vectors), min(n, len(vectors)), replace=False))
+    queries = np.asarray(vectors[rows], dtype=np.float32)
+    queries += rng.normal(scale=noise * float(np.abs(queries).mean() or 1), size=queries.shape).astype(np.float32)
+
+    return queries
+
+
+def get_arg_parser():
+    parser = argparse.ArgumentParser(description='Build and benchmark the library vector store.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for name in ('build', 'bench'):
+        sub = subparsers.add_parser(name)
+        source = sub.add_mutually_exclusive_group(required=True)
+        source.add_argument('--corpus', help='JSONL chunk corpus, one {"text", "metadata"} object per line')
+        source.add_argument('--from', dest='source', help='existing library folder (e.g. vecstore_backup)')
+        sub.add_argument('--nlist', type=int, help='IVF lists (default ~4*sqrt(chunks))')
+        sub.add_argument('--hnsw-m', type=int, default=32, help='HNSW links per node')
+        sub.add_argument('--pq-m', type=int, help='PQ sub-vectors (default dim/16)')
+        sub.add_argument('--nprobe', type=int, default=16, help='IVF lists searched per query')
+        sub.add_argument('--ef-search', type=int, default=64, help='HNSW candidate list size per query')
+        sub.add_argument('--cache-dir', default='cache', help='embedding cache used with --corpus')
+        sub.add_argument('--no-embedding-cache', action='store_true')
+
+    build = subparsers.choices['build']
+    build.add_argument('--out', default='vecstore_backup')
+    build.add_argument('--index', default='flat', choices=INDEX_TYPES)
+
+    bench = subparsers.choices['bench']
+    bench.add_argument('--index', nargs='+', default=INDEX_TYPES, choices=INDEX_TYPES)
+    bench.add_argument('--k', type=int, default=4)
+    bench.add_argument('--queries', type=int, default=200)
+
+    return parser
+
+
+def main(args):
+    build_kwargs = {'nlist': args.nlist, 'hnsw_m': args.hnsw_m, 'pq_m': args.pq_m}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        docs, vectors = load_source(args, workdir)
+        print('{} chunks, {}-d'.format(len(docs), vectors.shape[1]))
+
+        if args.command == 'bench':
+            queries = sample_queries(vectors, args.queries)
+            rows = evaluate(vectors, queries, args.index, k=args.k, nprobe=args.nprobe, ef_search=args.ef_search, **build_kwargs)
+            print_rows(rows)
+            return rows
+
+        index, spec = build_index(vectors, args.index, **build_kwargs)
+        config = {
+            'index_type': args.index,
+            'spec': spec,
+            'count': index.ntotal,
+            'dim': index.d,
+            'nprobe': args.nprobe,
+            'ef_search': args.ef_search
+        }
+        save_library(args.out, index, docs, config)
+        print('Wrote {} ({}, {} chunks)'.format(args.out, spec, index.ntotal))
+
+
+if __name__ == '__main__':
+    main(get_arg_parser().parse_args())
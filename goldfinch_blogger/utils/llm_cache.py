@@ -0,0 +1,62 @@
+from typing import Any, List, Optional
+
+from langchain.chat_models import ChatOpenAI
+from langchain.chat_models.openai import _convert_dict_to_message, _convert_message_to_dict
+from langchain.callbacks.manager import CallbackManagerForLLMRun
+from langchain.schema import BaseMessage, ChatGeneration, ChatResult
+
+from utils.cache import hash_key
+
+
+# Request params that don't change what the model returns
+NON_SEMANTIC_PARAMS = ('api_key', 'api_base', 'organization', 'request_timeout', 'stream')
+
+
+class CachedChatOpenAI(ChatOpenAI):
+    """ChatOpenAI that reuses responses from a DiskCache.
+
+    Responses are keyed by model, temperature and the full rendered prompt.
+    Calls sampled at temperature > 0 are only cached with `cache_sampled`.
+    """
+
+    response_cache: Any = None
+    cache_sampled: bool = False
+    cache_hits: int = 0
+    cache_misses: int = 0
+
+
+    def cacheable(self):
+        return self.response_cache is not None and (self.temperature == 0 or self.cache_sampled)
+
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if not self.cacheable():
+            return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+        message_dicts, params = self._create_message_dicts(messages, stop)
+        params = {k: v for k, v in {**params, **kwargs}.items() if k not in NON_SEMANTIC_PARAMS}
+        key = hash_key(self.model_name, self.temperature, params, message_dicts)
+
+        entry = self.response_cache.get(key)
+        if entry is not None:
+            self.cache_hits += 1
+            generations = [
+                ChatGeneration(message=_convert_dict_to_message(message))
+                for message in entry['value']['messages']
+            ]
+            llm_output = {'token_usage': {}, 'model_name': self.model_name, 'cached': True}
+            return ChatResult(generations=generations, llm_output=llm_output)
+
+        self.cache_misses += 1
+        result = super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        self.response_cache.set(key, {
+            'messages': [_convert_message_to_dict(g.message) for g in result.generations],
+        })
+
+        return result
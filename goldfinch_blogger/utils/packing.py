@@ -0,0 +1,127 @@
+"""Fit a section's gathered context into a token budget before drafting.
+
+Library answers and search contexts are split into passages that keep their
+`source: ...` attribution. Exact repeats are dropped, near duplicates are
+dropped by embedding similarity, and the rest are picked by maximal marginal
+relevance to the section and its questions until the budget is full.
+"""
+import re
+
+import numpy as np
+
+
+SOURCE_LINE = re.compile(r'^source: ?(.*)$', re.MULTILINE)
+
+
+def split_passages(text, kind, query=None):
+    """Passages of one context string, one per paragraph, under the nearest `source:` line."""
+    headers = list(SOURCE_LINE.finditer(text))
+    spans = [(None, 0, headers[0].start() if headers else len(text))]
+    for i, header in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(text)
+        spans.append((header.group(1).strip() or None, header.end(), end))
+
+    passages = []
+    for source, start, end in spans:
+        for paragraph in re.split(r'\n\s*\n', text[start:end]):
+            paragraph = paragraph.strip()
+            if paragraph:
+                passages.append({'kind': kind, 'source': source, 'query': query, 'text': paragraph})
+
+    return passages
+
+
+def render(passage):
+    if passage['source']:
+        return 'source: {}\n{}'.format(passage['source'], passage['text'])
+    return passage['text']
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype='float32')
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def select(relevance, vectors, tokens, budget, threshold=0.9, diversity=0.3):
+    """Greedy MMR under a token budget. Returns (picked indices, near duplicates, over budget)."""
+    picked = []
+    similar = np.zeros(len(tokens), dtype='float32')
+    remaining = set(range(len(tokens)))
+    duplicates = over_budget = 0
+    used = 0
+    while remaining:
+        scores = (1 - diversity) * relevance - diversity * similar
+        i = max(remaining, key=lambda j: scores[j])
+        remaining.discard(i)
+        if picked and similar[i] >= threshold:
+            duplicates += 1
+            continue
+        if used + tokens[i] > budget:
+            # a shorter passage further down may still fit
+            over_budget += 1
+            continue
+
+        picked.append(i)
+        used += tokens[i]
+        similar = np.maximum(similar, vectors @ vectors[i])
+
+    return picked, duplicates, over_budget
+
+
+def pack_context(section, library, search, embeddings, tokenizer, budget, threshold=0.9, diversity=0.3):
+    """Pack {query: answer} library and {query: [contexts]} search results into `budget` tokens.
+
+    Returns (library text, search text, stats), passages in their original order.
+    """
+    passages = []
+    for query, answer in library.items():
+        passages.extend(split_passages(answer, 'library', query))
+    for query, contexts in search.items():
+        for context in contexts:
+            passages.extend(split_passages(context, 'search', query))
+
+    stats = {
+        'passages': len(passages),
+        'tokens_in': len(tokenizer.encode('\n'.join(library.values()))) + len(tokenizer.encode(
+            '\n'.join(c for contexts in search.values() for c in contexts)
+        ))
+    }
+
+    unique = {}
+    for passage in passages:
+        unique.setdefault((passage['source'], passage['text']), passage)
+    passages = list(unique.values())
+    stats['repeats'] = stats['passages'] - len(passages)
+
+    picked = []
+    stats['duplicates'] = stats['over_budget'] = 0
+    if passages:
+        texts = [render(passage) for passage in passages]
+        tokens = [len(tokenizer.encode(text)) + 1 for text in texts]
+        queries = [section] + list(dict.fromkeys(passage['query'] for passage in passages))
+        vectors = normalize(embeddings.embed_documents(texts + queries))
+        passage_vectors, query_vectors = vectors[:len(texts)], vectors[len(texts):]
+
+        # relevance to the section or to the question the passage answers, whichever is closer
+        to_section = passage_vectors @ query_vectors[0]
+        to_query = np.array([
+            passage_vectors[i] @ query_vectors[queries.index(passage['query'])]
+            for i, passage in enumerate(passages)
+        ])
+        relevance = np.maximum(to_section, to_query)
+
+        picked, stats['duplicates'], stats['over_budget'] = select(
+            relevance, passage_vectors, tokens, budget, threshold=threshold, diversity=diversity
+        )
+
+    picked = [passages[i] for i in sorted(picked)]
+    full_library = '\n'.join(render(passage) for passage in picked if passage['kind'] == 'library')
+    full_search = '\n'.join(render(passage) for passage in picked if passage['kind'] == 'search')
+
+    stats['kept'] = len(picked)
+    stats['tokens_out'] = len(tokenizer.encode(full_library)) + len(tokenizer.encode(full_search))
+    stats['tokens_saved'] = stats['tokens_in'] - stats['tokens_out']
+
+    return full_library, full_search, stats
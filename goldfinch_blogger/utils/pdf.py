@@ -0,0 +1,89 @@
+import io
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+# One pool of extraction workers per process, shared by every document
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+# In a worker: the documents it has parsed, oldest first
+_readers = {}
+MAX_READERS = 4
+
+
+def open_pdf(data):
+    from PyPDF2 import PdfReader
+
+    return PdfReader(io.BytesIO(data))
+
+
+def _extract_pages(key, data, start, end):
+    # A worker parses each document once, however many of its batches it gets
+    if key not in _readers:
+        if len(_readers) >= MAX_READERS:
+            _readers.pop(next(iter(_readers)))
+        _readers[key] = open_pdf(data)
+    reader = _readers[key]
+    return [reader.pages[i].extract_text() for i in range(start, end)]
+
+
+def process_context():
+    # Don't fork a process that has scraper threads running
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+def get_pool(workers):
+    """The process's extraction pool, with the most workers any caller has asked for."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or workers > _pool_workers:
+            old = _pool
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=process_context())
+            _pool_workers = workers
+            if old is not None:
+                # batches already queued on it still finish
+                old.shutdown(wait=False)
+        return _pool
+
+
+def _reset_pool(pool):
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is pool:
+            _pool, _pool_workers = None, 0
+
+
+def iter_page_text(data, workers=1, min_pages=100, batch_size=25, reader=None):
+    """Yield the text of each page of an in-memory PDF, in order.
+
+    `reader` is the document already opened with open_pdf, if the caller has
+    one. Documents with at least `min_pages` pages are extracted on the shared
+    process pool in batches of `batch_size` pages; pages are yielded as soon
+    as their batch is done, so they can stream straight into the splitter.
+    """
+    if reader is None:
+        reader = open_pdf(data)
+    n_pages = len(reader.pages)
+
+    if workers <= 1 or n_pages < min_pages:
+        for page in reader.pages:
+            yield page.extract_text()
+        return
+
+    key = hashlib.sha1(data).hexdigest()
+    starts = range(0, n_pages, batch_size)
+    ends = [min(start + batch_size, n_pages) for start in starts]
+    pool = get_pool(workers)
+    try:
+        for pages in pool.map(_extract_pages, [key]*len(ends), [data]*len(ends), starts, ends):
+            yield from pages
+    except BrokenProcessPool:
+        # a worker died, the next document starts a new pool
+        _reset_pool(pool)
+        raise
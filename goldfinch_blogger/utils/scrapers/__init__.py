@@ -1 +1,2 @@
+from .base import scraper_classes, source_configs
 from .crowdstrike import *
\ No newline at end of file
@@ -1,5 +1,125 @@
-from selenium.webdriver import Chrome
-from selenium.webdriver.chrome.options import Options as ChromeOptions
+import atexit
+import threading
+from contextlib import contextmanager
+
+from selenium.common.exceptions import WebDriverException
+
+from utils.scrapers.fetch import TieredFetcher
+
+
+class DriverPool():
+  """Headless Chrome drivers shared by every Scraper.
+
+  Drivers are created lazily up to `size`, health checked before being handed
+  out, and recycled after `max_pages` page loads or whenever a borrower hits a
+  WebDriverException. Everything left is quit at interpreter exit.
+  """
+
+  def __init__(self, factory, size=3, max_pages=25):
+    self.factory = factory
+    self.size = size
+    self.max_pages = max_pages
+    self._idle = []
+    self._drivers = set()
+    self._live = 0
+    self._closed = False
+    self._cond = threading.Condition()
+
+
+  def configure(self, size=None, max_pages=None):
+    with self._cond:
+      if size is not None:
+        self.size = max(1, size)
+      if max_pages is not None:
+        self.max_pages = max(1, max_pages)
+      self._cond.notify_all()
+
+
+  @contextmanager
+  def driver(self):
+    driver, pages = self._acquire()
+    healthy = True
+    try:
+      yield driver
+    except WebDriverException:
+      healthy = False
+      raise
+    finally:
+      self._release(driver, pages + 1, healthy)
+
+
+  def is_healthy(self, driver):
+    try:
+      driver.execute_script('return 1')
+      return True
+    except Exception:
+      return False
+
+
+  def close(self):
+    with self._cond:
+      self._closed = True
+      drivers = list(self._drivers)
+      self._idle = []
+      self._cond.notify_all()
+
+    for driver in drivers:
+      self._quit(driver)
+
+
+  def _acquire(self):
+    with self._cond:
+      if self._closed:
+        raise RuntimeError('DriverPool is closed')
+      while not self._idle and self._live >= self.size:
+        self._cond.wait()
+      if self._idle:
+        driver, pages = self._idle.pop()
+      else:
+        driver, pages = None, 0
+        self._live += 1
+
+    # Replace a driver whose browser died while it sat idle
+    if driver is not None and not self.is_healthy(driver):
+      self._quit(driver)
+      driver, pages = None, 0
+
+    if driver is None:
+      try:
+        driver = self.factory()
+      except Exception:
+        with self._cond:
+          self._live -= 1
+          self._cond.notify()
+        raise
+      with self._cond:
+        self._drivers.add(driver)
+
+    return driver, pages
+
+
+  def _release(self, driver, pages, healthy):
+    with self._cond:
+      recycle = not healthy or pages >= self.max_pages or self._closed or self._live > self.size
+
+    if recycle:
+      self._quit(driver)
+
+    with self._cond:
+      if recycle:
+        self._live -= 1
+      else:
+        self._idle.append((driver, pages))
+      self._cond.notify()
+
+
+  def _quit(self, driver):
+    with self._cond:
+      self._drivers.discard(driver)
+    try:
+      driver.quit()
+    except Exception:
+      pass
 
 
 class Scraper():
@@ -8,10 +128,19 @@ class Scraper():
   new_post_date: str = None
   new_post_author: str = None
   new_post_content: str = None
+  # set by get_new_posts when new posts were left on unread listing pages
+  truncated: bool = False
+
+  driver_pool: DriverPool = None
+  fetcher: TieredFetcher = None
 
 
   @classmethod
   def get_selenium(self):
+    # webdriver takes a while to import, and most runs never start a browser
+    from selenium.webdriver import Chrome
+    from selenium.webdriver.chrome.options import Options as ChromeOptions
+
     try:
       chrome_options = ChromeOptions()
       chrome_options.add_argument("--headless")
@@ -33,9 +162,53 @@ class Scraper():
     return driver
 
 
+  def get_html(self, url, selector=None, timeout=None):
+    return self.fetcher.fetch(url, selector=selector, timeout=timeout)
+
+
   def get_latest_post_meta(self):
     raise NotImplementedError
 
 
+  def get_new_posts(self, since, max_pages=5):
+    """Posts newer than `since`, newest first, as {'url', 'title', 'date', 'author'}.
+
+    Scrapers that can read their listing pages should return every new post,
+    and set `truncated` when `max_pages` ran out first; this fallback only sees
+    the latest one.
+    """
+    url, date = self.get_latest_post_meta()
+    if date <= since:
+      return []
+
+    return [{'url': url, 'title': self.new_post_title, 'date': date, 'author': self.new_post_author}]
+
+
   def scrape_post(self):
-    raise NotImplementedError
\ No newline at end of file
+    raise NotImplementedError
+
+
+def scraper_classes():
+  classes, found = list(Scraper.__subclasses__()), {}
+  while classes:
+    cls = classes.pop()
+    classes.extend(cls.__subclasses__())
+    found[cls.__name__] = cls
+
+  return found
+
+
+def source_configs():
+  """{source: {'source', 'scraper'}} for every Scraper subclass with a `source` set."""
+  return {
+    cls.source: {'source': cls.source, 'scraper': name}
+    for name, cls in scraper_classes().items() if getattr(cls, 'source', None)
+  }
+
+
+driver_pool = DriverPool(Scraper.get_selenium)
+atexit.register(driver_pool.close)
+fetcher = TieredFetcher(driver_pool)
+
+Scraper.driver_pool = driver_pool
+Scraper.fetcher = fetcher
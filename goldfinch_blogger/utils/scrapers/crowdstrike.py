@@ -1,6 +1,4 @@
-import time
 from datetime import datetime
-from bs4 import BeautifulSoup
 
 from utils.scrapers.base import Scraper
 
@@ -10,46 +8,78 @@ class CrowdstrikeScraper(Scraper):
   source = None
   base_url = 'https://www.crowdstrike.com'
 
-  def __init__(self):
-    self.driver = self.get_selenium()
+  def parse_listing(self, html):
+    """Posts on a category page, newest first, as {'url', 'title', 'date', 'author'}."""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'lxml')
 
+    posts = []
+    for article in soup.find_all("div", {"class": "row category_article flex-lg-row"}):
+      link = article.find_all('h3')[0].find_all('a')[0]
+      publish_info = article.find_all('div', {'class': 'publish_info'})[0]
+      posts.append({
+        'url': self.base_url + link['href'],
+        'title': article.find_all('h3')[0].text,
+        'date': datetime.strptime(publish_info.find('p').text, '%B %d, %Y').astimezone(),
+        'author': publish_info.find('a').text
+      })
 
-  def get_latest_post_meta(self):
-    self.driver.get(self.blog_url)
-    time.sleep(5)
-    html = self.driver.execute_script("return document.getElementsByTagName('html')[0].innerHTML")
+    return posts
 
-    soup = BeautifulSoup(html, 'lxml')
 
-    articles = soup.find_all("div", {"class": "row category_article flex-lg-row"})
+  def get_latest_post_meta(self):
+    html = self.get_html(self.blog_url, selector='div.category_article')
+    latest = self.parse_listing(html)[0]
 
-    link = articles[0].find_all('h3')[0].find_all('a')[0]['href']
-    self.new_post_url = self.base_url + link
+    self.new_post_url = latest['url']
     print(self.new_post_url)
 
-    title = articles[0].find_all('h3')[0].text
-    self.new_post_title = title
+    self.new_post_title = latest['title']
     print(self.new_post_title)
 
-    post_date = articles[0].find_all('div', {'class': 'publish_info'})[0].find('p').text
-    post_date = datetime.strptime(post_date, '%B %d, %Y').astimezone()
-    self.new_post_date = post_date
+    self.new_post_date = latest['date']
     print(self.new_post_date)
 
-    author = articles[0].find_all('div', {'class': 'publish_info'})[0].find('a').text
-    self.new_post_author = author
+    self.new_post_author = latest['author']
     print(self.new_post_author)
 
     return self.new_post_url, self.new_post_date
 
 
+  def get_new_posts(self, since, max_pages=5):
+    listing = self.parse_listing(self.get_html(self.blog_url, selector='div.category_article'))
+    page_size = len(listing)
+
+    posts = []
+    self.truncated = False
+    for page in range(2, max_pages + 2):
+      newer = [post for post in listing if post['date'] > since]
+      posts.extend(newer)
+      # listings are newest first, so an older post or a short page means we've caught up
+      if len(newer) < page_size:
+        break
+      if page > max_pages:
+        # the posts on later pages are still newer than `since`
+        self.truncated = True
+        break
+
+      try:
+        url = '{}/page/{}/'.format(self.blog_url.rstrip('/'), page)
+        listing = self.parse_listing(self.get_html(url, selector='div.category_article'))
+      except Exception as e:
+        # pages past the last one 404
+        print('Stopped at {}: {}'.format(url, e))
+        break
+
+    return posts
+
+
   def scrape_post(self, url=None):
     post_url = url or self.new_post_url
     
-    self.driver.get(post_url)
-    time.sleep(5)
-    html = self.driver.execute_script("return document.getElementsByTagName('html')[0].innerHTML")
+    html = self.get_html(post_url, selector='div.blog_content')
 
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(html, 'lxml')
 
     self.new_post_content = soup.find_all("div", {"class": "blog_content"})[0].text
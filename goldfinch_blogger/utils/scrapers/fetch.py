@@ -0,0 +1,252 @@
+import json
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from selenium.common.exceptions import TimeoutException
+
+from utils.cache import OfflineCacheMiss
+
+
+HEADERS = {
+  'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0 Safari/537.36',
+  'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+  'Accept-Language': 'en-US,en;q=0.9',
+}
+
+
+def decode(content, meta):
+  return content.decode(meta.get('encoding') or 'utf-8', errors='replace')
+
+
+def visible_text(html):
+  from bs4 import BeautifulSoup
+  soup = BeautifulSoup(html, 'lxml')
+  for script in soup(["script", "style", "noscript"]):
+    script.extract()
+
+  return ' '.join(soup.get_text().split())
+
+
+class DomainLimiter():
+  """Politeness per host: at most `max_per_domain` requests in flight, started `delay` seconds apart."""
+
+  def __init__(self, max_per_domain=2, delay=1.0):
+    self.max_per_domain = max_per_domain
+    self.delay = delay
+    self._domains = {}
+    self._lock = threading.Lock()
+
+
+  @contextmanager
+  def slot(self, url):
+    host = urlparse(url).netloc.lower()
+    with self._lock:
+      if host not in self._domains:
+        self._domains[host] = {'semaphore': threading.Semaphore(self.max_per_domain), 'next': 0.0}
+      domain = self._domains[host]
+
+    with domain['semaphore']:
+      # reserve the next start time for this host, then wait for it
+      with self._lock:
+        start = max(time.monotonic(), domain['next'])
+        domain['next'] = start + self.delay
+      time.sleep(max(0.0, start - time.monotonic()))
+      yield
+
+
+class TieredFetcher():
+  """Fetch a page with a plain GET first and fall back to a pooled browser.
+
+  The static response is only used if it already has the content we want:
+  the target `selector` when one is given, otherwise at least `min_text_chars`
+  of visible text. With a PageCache attached, fresh pages are served from disk
+  and stale ones are revalidated with ETag/Last-Modified. With a DomainLimiter
+  as `politeness`, network requests wait their turn per host. Which tier served
+  each url is kept in `log`, for the last `max_log` urls if that's set.
+  """
+
+  def __init__(self, driver_pool, min_text_chars=1000, pool_size=16, cache=None, politeness=None, max_log=None):
+    self.driver_pool = driver_pool
+    self.min_text_chars = min_text_chars
+    self.cache = cache
+    self.politeness = politeness
+    self.max_log = max_log
+    self.log = {}
+    self._lock = threading.Lock()
+
+    self.session = requests.Session()
+    self.session.headers.update(HEADERS)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    self.session.mount('http://', adapter)
+    self.session.mount('https://', adapter)
+
+
+  def fetch(self, url, selector=None, timeout=None):
+    start = time.monotonic()
+    reason = None
+    try:
+      content, meta, tier = self.get(url, timeout=timeout)
+      html = decode(content, meta)
+      # cached pages already passed this check when they were stored
+      if tier == 'static':
+        reason = self.needs_browser(html, selector)
+        if reason is None:
+          self.store(url, content, meta)
+    except requests.RequestException as e:
+      reason = repr(e)
+
+    if reason is not None:
+      tier = 'browser'
+      html = self.fetch_browser(url, selector=selector, timeout=timeout)
+      self.store(url, html.encode('utf-8'), {'encoding': 'utf-8', 'tier': 'browser'})
+
+    self.record(url, tier=tier, reason=reason, seconds=round(time.monotonic() - start, 3))
+
+    return html
+
+
+  def fetch_bytes(self, url, timeout=None):
+    start = time.monotonic()
+    content, meta, tier = self.get(url, timeout=timeout)
+    if tier == 'static':
+      self.store(url, content, meta)
+
+    self.record(url, tier=tier, reason=None, seconds=round(time.monotonic() - start, 3))
+
+    return content
+
+
+  def get(self, url, timeout=None):
+    """Plain GET through the page cache. Returns (content, meta, tier)."""
+    cached = self.cache.lookup(url) if self.cache is not None else None
+    offline = self.cache is not None and self.cache.offline
+
+    if cached is not None and (cached['fresh'] or offline):
+      return cached['content'], cached['meta'], 'cache'
+    if offline:
+      raise OfflineCacheMiss(url)
+
+    headers = {}
+    if cached is not None:
+      if cached['meta'].get('etag'):
+        headers['If-None-Match'] = cached['meta']['etag']
+      if cached['meta'].get('last_modified'):
+        headers['If-Modified-Since'] = cached['meta']['last_modified']
+
+    with self.slot(url):
+      r = self.session.get(url, timeout=timeout or 30, headers=headers)
+    if r.status_code == 304 and cached is not None:
+      self.cache.revalidated(url)
+      return cached['content'], cached['meta'], 'revalidated'
+    r.raise_for_status()
+
+    meta = {
+      'status': r.status_code,
+      'etag': r.headers.get('ETag'),
+      'last_modified': r.headers.get('Last-Modified'),
+      'content_type': r.headers.get('Content-Type'),
+      'encoding': r.encoding or r.apparent_encoding,
+      'tier': 'static',
+    }
+
+    return r.content, meta, 'static'
+
+
+  def store(self, url, content, meta):
+    if self.cache is not None:
+      self.cache.put(url, content, meta=dict(meta, fetched_at=time.time()))
+
+
+  def cached_text(self, url):
+    if self.cache is None:
+      return None
+
+    page = self.cache.lookup(url)
+    if page is not None and page['text'] and (page['fresh'] or self.cache.offline):
+      self.record(url, tier='cache', reason=None, seconds=0.0)
+      return page['text']
+
+    return None
+
+
+  def save_text(self, url, text):
+    if self.cache is not None:
+      self.cache.set_text(url, text)
+
+
+  def needs_browser(self, html, selector=None):
+    if selector:
+      from bs4 import BeautifulSoup
+      if BeautifulSoup(html, 'lxml').select_one(selector) is None:
+        return 'missing {}'.format(selector)
+      return None
+
+    n_chars = len(visible_text(html))
+    if n_chars < self.min_text_chars:
+      return 'only {} chars of text'.format(n_chars)
+
+    return None
+
+
+  def fetch_browser(self, url, selector=None, timeout=None):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    timeout = timeout or 30
+    with self.slot(url), self.driver_pool.driver() as driver:
+      # pooled drivers keep their settings, so always reset the load timeout
+      driver.set_page_load_timeout(timeout)
+      driver.get(url)
+
+      # Wait until the page is ready instead of sleeping a fixed amount
+      try:
+        if selector:
+          WebDriverWait(driver, timeout).until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, selector))
+          )
+        else:
+          WebDriverWait(driver, timeout).until(
+            lambda d: d.execute_script('return document.readyState') == 'complete'
+          )
+      except TimeoutException:
+        print('Timed out waiting for {}, using what has rendered'.format(url))
+
+      html = driver.execute_script("return document.getElementsByTagName('html')[0].innerHTML")
+
+    return html
+
+
+  def slot(self, url):
+    if self.politeness is None:
+      return nullcontext()
+    return self.politeness.slot(url)
+
+
+  def record(self, url, **info):
+    with self._lock:
+      # most recent last, so the oldest are dropped first
+      self.log.pop(url, None)
+      self.log[url] = info
+      if self.max_log is not None:
+        while len(self.log) > self.max_log:
+          del self.log[next(iter(self.log))]
+
+
+  def tier_counts(self):
+    with self._lock:
+      return Counter(info['tier'] for info in self.log.values())
+
+
+  def save_log(self, path, urls=None):
+    """Write `log` as json, only the entries of `urls` if given."""
+    with self._lock:
+      log = dict(self.log) if urls is None else {url: self.log[url] for url in urls if url in self.log}
+
+    with open(path, 'w') as f:
+      json.dump(log, f, indent=2)
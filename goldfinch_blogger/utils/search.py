@@ -0,0 +1,106 @@
+import os
+import threading
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.cache import OfflineCacheMiss
+from utils.tracing import tracer
+
+
+SERPER_URL = 'https://google.serper.dev/search'
+
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+
+class SearchClient():
+    """Serper search shared by the blogger and the chain tools.
+
+    One pooled HTTP session, an optional DiskCache keyed by normalized query,
+    and in-flight de-duplication so concurrent identical queries share a
+    single request.
+    """
+
+    def __init__(self, cache=None, offline=False, gl='us', hl='en', num=10, pool_size=8):
+        self.cache = cache
+        self.offline = offline
+        self.gl = gl
+        self.hl = hl
+        self.num = num
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+
+
+    def results(self, query):
+        key = normalize_query(query)
+
+        if self.cache is not None:
+            entry = self.cache.get(key)
+            if entry is not None:
+                with self._lock:
+                    self.hits += 1
+                tracer.add(search_cache_hits=1)
+                return entry['value']
+        if self.offline:
+            raise OfflineCacheMiss(query)
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            tracer.add(search_coalesced=1)
+            return future.result()
+
+        tracer.add(search_requests=1)
+
+        try:
+            result = self.search(query)
+            if self.cache is not None:
+                self.cache.set(key, result)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+
+    def search(self, query):
+        headers = {
+            'X-API-KEY': os.environ['SERPER_API_KEY'],
+            'Content-Type': 'application/json',
+        }
+        payload = {'q': query, 'gl': self.gl, 'hl': self.hl, 'num': self.num}
+
+        r = self.session.post(SERPER_URL, headers=headers, json=payload, timeout=30)
+        r.raise_for_status()
+
+        return r.json()
+
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced}
+
+
+search_client = SearchClient()
@@ -0,0 +1,356 @@
+"""Serve blog generation over HTTP, with the pipeline kept warm between jobs.
+
+The LLM clients, library index, chains, browser pool and caches are built
+once at startup. Outline jobs wait in a bounded queue, and when it's full
+POST /jobs answers 429 with a Retry-After. `--max-jobs` jobs run at once, and
+all their sections share one pool of `--max-parallel-sections` workers.
+
+    POST /jobs              outline as text/plain, or JSON {"outline": ...}. 202 with the job
+    POST /jobs?stream=1     the same, then the job's events in the response
+    GET  /jobs/<id>         status, sections done, and the blog once it's done
+    GET  /jobs/<id>/events  NDJSON progress: queued, started, section (with its draft), done or failed.
+                            ?since=N skips the first N events
+    GET  /health            queue and worker counts
+
+Each job is written to `--output_dir`/jobs/<id>/, with its own trace.json and fetch_tiers.json.
+
+From goldfinch_blogger/: python -m utils.server --port 8000 --max-jobs 2 --max-queued 8
+"""
+import os
+import json
+import math
+import time
+import uuid
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import GoldfinchBlogger as gb
+from utils.scrapers.base import driver_pool, fetcher
+from utils.tracing import tracer
+
+
+TERMINAL = ('done', 'failed')
+
+# urls whose fetch tier the shared fetcher remembers; each job saves its own
+FETCH_LOG_SIZE = 10000
+
+
+class Job():
+
+    def __init__(self, outline, out_dir, sections):
+        self.id = os.path.basename(out_dir)
+        self.outline = outline
+        self.out_dir = out_dir
+        self.sections = sections
+        self.sections_done = 0
+        self.status = 'queued'
+        self.blog = None
+        self.error = None
+        self.created = time.time()
+        self.started = self.finished = None
+        self.events = []
+        self._changed = threading.Condition()
+
+
+    def emit(self, event, **data):
+        with self._changed:
+            self.events.append(dict(event=event, job=self.id, time=round(time.time(), 3), **data))
+            self._changed.notify_all()
+
+
+    def finish(self, status, **data):
+        self.status = status
+        self.finished = time.time()
+        self.emit(status, seconds=round(self.finished - self.started, 3), **data)
+
+
+    def follow(self, since=0, heartbeat=15):
+        """Events from `since` on, as they happen, until the job ends."""
+        i = since
+        while True:
+            with self._changed:
+                if i >= len(self.events) and self.status not in TERMINAL:
+                    self._changed.wait(timeout=heartbeat)
+                events = self.events[i:]
+                ended = self.status in TERMINAL
+
+            if not events and not ended:
+                # keeps proxies from closing the stream, and finds clients that left
+                yield {'event': 'heartbeat', 'job': self.id}
+            for event in events:
+                yield event
+            i += len(events)
+            if ended and i >= len(self.events):
+                return
+
+
+    def summary(self):
+        summary = {
+            'id': self.id,
+            'status': self.status,
+            'sections': self.sections,
+            'sections_done': self.sections_done,
+            'out_dir': self.out_dir,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'error': self.error
+        }
+        if self.status == 'done':
+            summary['blog'] = self.blog
+
+        return summary
+
+
+class JobServer(ThreadingHTTPServer):
+    """Bounded outline queue, `max_jobs` job workers and one shared section pool."""
+
+    daemon_threads = True
+
+    def __init__(self, address, args, resources=None, max_jobs=2, max_queued=8, keep_jobs=100):
+        tracer.start()
+        fetcher.max_log = FETCH_LOG_SIZE
+        self.args = args
+        self.resources = resources or gb.BlogResources(args)
+        self.max_jobs = max_jobs
+        self.keep_jobs = keep_jobs
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.jobs = OrderedDict()
+        self.durations = []
+        self._lock = threading.Lock()
+        self.sections_pool = ThreadPoolExecutor(max_workers=max(1, args.max_parallel_sections))
+        self.workers = [threading.Thread(target=self.work, daemon=True) for _ in range(max(1, max_jobs))]
+        for worker in self.workers:
+            worker.start()
+
+        super().__init__(address, JobHandler)
+
+
+    def submit(self, outline):
+        """Queue an outline. Raises queue.Full when the queue is, ValueError for an outline with no sections."""
+        sections = len(gb.parse_sections(outline))
+        if not sections:
+            raise ValueError('The outline has no SECTION: blocks')
+
+        job = Job(outline, os.path.join(self.args.output_dir, 'jobs', uuid.uuid4().hex[:12]), sections)
+        # queued before a worker can pick it up, so events stay in order
+        job.emit('queued', position=self.queue.qsize() + 1, sections=sections)
+        with self._lock:
+            self.queue.put_nowait(job)
+            self.jobs[job.id] = job
+
+        return job
+
+
+    def retry_after(self):
+        # how long until a queue slot frees up, going by recent jobs
+        with self._lock:
+            recent = self.durations[-20:]
+        average = sum(recent) / len(recent) if recent else 30
+
+        return max(1, math.ceil(average / self.max_jobs))
+
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            try:
+                self.run(job)
+            finally:
+                self.queue.task_done()
+
+
+    def run(self, job):
+        job.status = 'running'
+        job.started = time.time()
+        job.emit('started')
+        try:
+            futures = gb.submit_post(self.sections_pool, job.out_dir, job.outline, self.resources, self.args)
+            index = {future: idx for idx, future in enumerate(futures)}
+            for future in as_completed(futures):
+                try:
+                    draft = future.result()
+                except Exception as e:
+                    job.emit('section', section=index[future], status='failed', error=repr(e))
+                else:
+                    job.sections_done += 1
+                    job.emit('section', section=index[future], status='done', draft=draft)
+
+            job.blog, failed = gb.assemble_post(job.out_dir, futures)
+            if failed:
+                job.error = 'Sections {} failed'.format(failed)
+        except Exception as e:
+            job.error = repr(e)
+
+        # the job's spans go to its own trace, so a long running server doesn't keep them
+        try:
+            trace = tracer.split(job.out_dir)
+            trace.save(os.path.join(job.out_dir, 'trace.json'), failed=job.error)
+            urls = {span.attrs['url'] for span in trace.spans if span.attrs.get('url')}
+            fetcher.save_log(os.path.join(job.out_dir, 'fetch_tiers.json'), urls=urls)
+        except Exception as e:
+            print('Issue saving the trace of job {}: {}'.format(job.id, e))
+
+        if job.error:
+            job.finish('failed', error=job.error)
+        else:
+            job.finish('done', blog=job.blog)
+        self.forget_old_jobs(job)
+
+
+    def forget_old_jobs(self, job):
+        with self._lock:
+            self.durations.append(job.finished - job.started)
+            finished = [old.id for old in self.jobs.values() if old.status in TERMINAL]
+            for job_id in finished[:max(0, len(finished) - self.keep_jobs)]:
+                del self.jobs[job_id]
+
+
+    def health(self):
+        with self._lock:
+            running = sum(job.status == 'running' for job in self.jobs.values())
+
+        return {
+            'queued': self.queue.qsize(),
+            'max_queued': self.queue.maxsize,
+            'running': running,
+            'max_jobs': self.max_jobs,
+            'max_parallel_sections': self.args.max_parallel_sections
+        }
+
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        for _ in self.workers:
+            self.queue.put(None)
+        self.sections_pool.shutdown(wait=False)
+        driver_pool.close()
+
+
+class JobHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    def stream(self, job, since=0):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        try:
+            for event in job.follow(since):
+                self.wfile.write((json.dumps(event) + '\n').encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/jobs':
+            self.send_json(404, {'error': 'not found'})
+            return
+
+        try:
+            length = int(self.headers['Content-Length'])
+            if length < 0:
+                raise ValueError
+            body = self.rfile.read(length).decode('utf-8')
+        except (TypeError, ValueError):
+            self.send_json(400, {'error': 'expected a Content-Length and a utf-8 body'})
+            return
+
+        outline = body
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            try:
+                outline = json.loads(body)['outline']
+            except (ValueError, KeyError, TypeError):
+                self.send_json(400, {'error': 'expected {"outline": "..."}'})
+                return
+
+        try:
+            job = self.server.submit(outline)
+        except queue.Full:
+            self.send_json(429, {'error': 'queue full', **self.server.health()},
+                           headers={'Retry-After': str(self.server.retry_after())})
+            return
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+
+        if parse_qs(url.query).get('stream', ['0'])[0] not in ('0', 'false', ''):
+            self.stream(job)
+        else:
+            self.send_json(202, job.summary(), headers={'Location': '/jobs/{}'.format(job.id)})
+
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        if parts == ['health']:
+            self.send_json(200, self.server.health())
+            return
+
+        job = self.server.jobs.get(parts[1]) if len(parts) in (2, 3) and parts[0] == 'jobs' else None
+        if job is None:
+            self.send_json(404, {'error': 'not found'})
+        elif len(parts) == 2:
+            self.send_json(200, job.summary())
+        elif parts[2] == 'events':
+            try:
+                since = int(parse_qs(url.query).get('since', ['0'])[0])
+                if since < 0:
+                    raise ValueError
+            except ValueError:
+                self.send_json(400, {'error': 'since must be an event index'})
+                return
+            self.stream(job, since=since)
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+
+    def log_message(self, format, *args):
+        print('{} {}'.format(self.address_string(), format % args))
+
+
+def get_arg_parser():
+    parser = gb.get_arg_parser()
+    parser.description = 'Serve blog generation over HTTP.'
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on')
+    parser.add_argument('--max-jobs', type=int, default=2, help='Outline jobs drafted at once')
+    parser.add_argument('--max-queued', type=int, default=8,
+                        help='Jobs waiting for a worker before new ones are turned away with a 429')
+    parser.add_argument('--keep-jobs', type=int, default=100, help='Finished jobs whose status is kept in memory')
+
+    return parser
+
+
+if __name__ == '__main__':
+    args = get_arg_parser().parse_args()
+
+    server = JobServer(
+        (args.host, args.port), args, max_jobs=args.max_jobs, max_queued=args.max_queued, keep_jobs=args.keep_jobs
+    )
+    print('Serving on http://{}:{}'.format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
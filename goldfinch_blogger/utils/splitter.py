@@ -0,0 +1,143 @@
+def split_sentences(text):
+    return [s.strip().replace('\n', ' ') for s in text.split('.')]
+
+
+def iter_chunks(pages, n, tokenizer, overlap=0, max_tokens=None):
+    """Yield (chunk, page_num) from an iterable of page texts.
+
+    A chunk is closed once it reaches 90% of `n` tokens, and chunks carry over
+    page breaks (page_num is the 1-based page the chunk ended on). Token counts
+    are kept incrementally, one sentence at a time: for tiktoken's BPE, a
+    string that ends in a non-space character tokenizes the same on its own as
+    it does as a prefix of " <next sentence>", so encoding each new piece
+    separately adds up to the same count as re-encoding the whole chunk.
+
+    `overlap` seeds each new chunk with trailing sentences of the previous one,
+    up to that many tokens. `max_tokens` is a hard cap: a chunk is closed early
+    rather than grow past it, and sentences longer than the cap are cut. The
+    seed shrinks to leave room under the cap for the sentence that follows it.
+    """
+    chunk = ''
+    head_tokens = 0     # tokens in chunk up to its last non-empty sentence
+    pending = 0         # empty sentences appended since then (trailing spaces)
+    sentences = []      # (piece, tokens) making up the chunk, for overlap
+    fresh = False       # the chunk is only the seed so far, nothing new to yield
+    num = 0
+
+    def seeded(limit):
+        seed = overlap_seed(sentences, min(overlap, limit))
+        while seed:
+            text = ''.join(piece for piece, _ in seed).lstrip(' ')
+            count = len(tokenizer.encode(text))
+            if count <= limit:
+                return text, count, [(text, count)], True
+            seed = seed[1:]
+        return '', 0, [], False
+
+    for num, page in enumerate(pages, start=1):
+        for s in split_sentences(page):
+            if max_tokens and s:
+                ids = tokenizer.encode(s)
+                if len(ids) > max_tokens:
+                    # Cut the sentence into windows, the remainder carries on as s
+                    if chunk != '' and not fresh:
+                        yield chunk, num
+                    windows = cut_tokens(ids, max_tokens, tokenizer)
+                    for window in windows[:-1]:
+                        yield window, num
+                    s = windows[-1]
+                    chunk, head_tokens, sentences, fresh = '', 0, [], False
+                    pending = 0
+                elif chunk != '' and head_tokens + len(tokenizer.encode(' '*(pending+1) + s)) > max_tokens:
+                    if not fresh:
+                        yield chunk, num
+                    chunk, head_tokens, sentences, fresh = seeded(max_tokens - len(tokenizer.encode(' ' + s)))
+                    pending = 0
+            elif max_tokens and chunk != '' and head_tokens + len(tokenizer.encode(' '*(pending+1))) > max_tokens:
+                # an empty sentence still adds a space to the chunk
+                if not fresh:
+                    yield chunk, num
+                chunk, head_tokens, sentences, fresh = seeded(max_tokens - len(tokenizer.encode(' ')))
+                pending = 0
+
+            # start new chunk
+            if chunk == '':
+                chunk = s
+                head_tokens = len(tokenizer.encode(s)) if s else 0
+                sentences = [(s, head_tokens)] if s else []
+                tokens = head_tokens
+            else:
+                chunk = chunk + ' ' + s
+                if s:
+                    piece = ' '*(pending+1) + s
+                    piece_tokens = len(tokenizer.encode(piece))
+                    head_tokens += piece_tokens
+                    sentences.append((piece, piece_tokens))
+                    pending = 0
+                    tokens = head_tokens
+                    fresh = False
+                else:
+                    pending += 1
+                    tokens = head_tokens + len(tokenizer.encode(' '*pending))
+
+            if tokens >= 0.9*n and not fresh:
+                yield chunk, num
+                chunk, head_tokens, sentences, fresh = seeded(max_tokens or overlap)
+                pending = 0
+
+    if chunk != '' and not fresh:
+        yield chunk, num
+
+
+def overlap_seed(sentences, limit):
+    seed = []
+    total = 0
+    for piece, count in reversed(sentences):
+        if total + count > limit:
+            break
+        seed.insert(0, (piece, count))
+        total += count
+
+    return seed
+
+
+def cut_tokens(ids, max_tokens, tokenizer):
+    """Texts of at most `max_tokens` tokens each, cut between characters, never inside one."""
+    def decoded(window):
+        try:
+            return tokenizer.decode_bytes(window).decode('utf-8')
+        except UnicodeDecodeError:
+            return None
+
+    def fits(window):
+        # decoded text can re-encode to more tokens than it was cut from
+        text = decoded(window)
+        return text is not None and len(tokenizer.encode(text)) <= max_tokens
+
+    texts = []
+    start = 0
+    while start < len(ids):
+        end = min(start + max_tokens, len(ids))
+        while end - start > 1 and not fits(ids[start:end]):
+            end -= 1
+        # a character that takes more tokens than the cap is kept whole
+        while end < len(ids) and decoded(ids[start:end]) is None:
+            end += 1
+        texts.append(tokenizer.decode(ids[start:end]))
+        start = end
+
+    return texts
+
+
+def text_splitter(text, n, tokenizer, **kwargs):
+    return [chunk for chunk, _ in iter_chunks([text], n, tokenizer, **kwargs)]
+
+
+def multi_page_text_splitter(pages, n, tokenizer, **kwargs):
+    chunks = []
+    page_nums = []
+    for chunk, num in iter_chunks(pages, n, tokenizer, **kwargs):
+        chunks.append(chunk)
+        page_nums.append(num)
+
+    return chunks, page_nums
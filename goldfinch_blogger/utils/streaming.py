@@ -0,0 +1,78 @@
+"""Stream a section draft to disk (and stdout) token by token as it's generated.
+
+Tokens are appended to `<path>.part` and flushed as they arrive. Once the
+completion ends the part file is fsynced and renamed over `path`, so `path`
+only ever holds a whole draft. After a crash the `.part` file shows how far
+the section got.
+"""
+import os
+import sys
+import time
+from typing import Any
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+
+class SectionStream(BaseCallbackHandler):
+    """Callback handler for one streamed section completion."""
+
+    def __init__(self, path, echo=False):
+        self.path = path
+        self.part_path = path + '.part'
+        self.echo = echo
+        self.file = None
+        self.tokens = 0
+        self.started = self.first_token = self.ended = None
+        self.completed = False
+
+
+    def on_llm_start(self, serialized, prompts, **kwargs: Any):
+        self.started = time.monotonic()
+        self.file = open(self.part_path, 'w')
+
+
+    def on_llm_new_token(self, token, **kwargs: Any):
+        if self.first_token is None:
+            self.first_token = time.monotonic()
+        self.tokens += 1
+
+        self.file.write(token)
+        self.file.flush()
+        if self.echo:
+            sys.stdout.write(token)
+            sys.stdout.flush()
+
+
+    def on_llm_end(self, response, **kwargs: Any):
+        self.ended = time.monotonic()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        if self.echo and self.tokens:
+            sys.stdout.write('\n')
+
+        # cached responses don't stream, the caller writes those itself
+        if self.tokens:
+            os.replace(self.part_path, self.path)
+            self.completed = True
+        else:
+            os.remove(self.part_path)
+
+
+    def on_llm_error(self, error, **kwargs: Any):
+        # leave the partial draft in .part
+        if self.file is not None:
+            self.file.close()
+
+
+    def stats(self):
+        if not self.completed:
+            return None
+
+        generating = max(self.ended - self.first_token, 1e-6)
+        return {
+            'first_token_seconds': round(self.first_token - self.started, 3),
+            'seconds': round(self.ended - self.started, 3),
+            'tokens': self.tokens,
+            'tokens_per_second': round(self.tokens / generating, 1)
+        }
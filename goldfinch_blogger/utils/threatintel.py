@@ -1,12 +1,15 @@
-import weaviate as wv
+import os
+import time
 import pathlib
 import json
 import re
+import sqlite3
+import hashlib
+import threading
 from datetime import datetime
-import tiktoken
-from PyPDF2 import PdfReader
 from tenacity import (
     retry,
+    retry_if_exception_type,
     stop_after_attempt,
     wait_random_exponential,
 )
@@ -15,7 +18,15 @@ import sys
 sys.path.append('..')
 
 from utils import scrapers
-#from utils.ScraperConfig import Config
+from utils.splitter import text_splitter, multi_page_text_splitter
+from utils.pdf import open_pdf, iter_page_text
+
+
+def generate_uuid5(identifier, namespace):
+    # weaviate is slow to import and only needed once something is loaded
+    from weaviate.util import generate_uuid5
+
+    return generate_uuid5(identifier, namespace)
 
 
 def get_or_create_source(source_config, wv_client):
@@ -39,7 +50,7 @@ def get_or_create_source(source_config, wv_client):
             'lastPostDate': datetime.fromisoformat("2000-01-01T00:00:00").astimezone().isoformat()
         }
 
-        uuid = wv.util.generate_uuid5({'source': source_config['source']}, 'DataSource')
+        uuid = generate_uuid5({'source': source_config['source']}, 'DataSource')
         source_uuid = wv_client.data_object.create(data_props, 'DataSource', uuid=uuid)
         result = data_props
     else:
@@ -69,19 +80,82 @@ def update_source(report_source, latest_post_date, wv_client):
     )
 
 
+def get_or_create_sources(source_configs, wv_client):
+    """get_or_create_source for many sources, in one query."""
+    where_filter = {
+        "operator": "Or",
+        "operands": [
+            {"path": ["source"], "operator": "Equal", "valueString": config['source']}
+            for config in source_configs
+        ]
+    }
+
+    result = (
+        wv_client.query
+        .get("DataSource", "source scraper lastPostDate _additional{ id }")
+        .with_where(where_filter)
+        .with_limit(len(source_configs))
+        .do()
+    )
+    sources = {
+        source['source']: dict(source, id=source['_additional']['id'])
+        for source in result['data']['Get']['DataSource']
+    }
+
+    missing = [config for config in source_configs if config['source'] not in sources]
+    for config in missing:
+        data_props = {
+            'source': config['source'],
+            'scraper': config['scraper'],
+            'lastPostDate': datetime.fromisoformat("2000-01-01T00:00:00").astimezone().isoformat()
+        }
+        uuid = generate_uuid5({'source': config['source']}, 'DataSource')
+        # new sources are rare, and a failed create should be seen, so not batched
+        try:
+            wv_client.data_object.create(data_props, 'DataSource', uuid=uuid)
+        except Exception as e:
+            # its watermark update will fail too, which marks the source as an error
+            print('Issue with {}: {}'.format(config['source'], e))
+        sources[config['source']] = dict(data_props, id=uuid)
+
+    return sources
+
+
+def update_sources(sources, latest_post_dates, wv_client):
+    """update_source for many sources, with the ids from get_or_create_sources. Returns {source: error} of failed writes."""
+    failed = {}
+    for report_source, latest_post_date in latest_post_dates.items():
+        # one call per source with new posts; unlike a batch import it raises when Weaviate turns it away
+        try:
+            wv_client.data_object.update(
+                data_object = {'lastPostDate': latest_post_date.isoformat()},
+                class_name = 'DataSource',
+                uuid = sources[report_source]['id']
+            )
+        except Exception as e:
+            print('Issue with {}: {}'.format(report_source, e))
+            failed[report_source] = repr(e)
+
+    return failed
+
+
+def last_post_date(source):
+    try:
+        return datetime.fromisoformat(source['lastPostDate'])
+    except:
+        return datetime.strptime('2023-05-15T00:00:00Z', "%Y-%m-%dT%H:%M:%SZ").astimezone()
+
+
 def scrape_threatintel_report(report_source, url=None, wv_client=None):
-    config = Config[report_source]
-    scraper = getattr(scrapers, config['scraper'])()
+    config = scrapers.source_configs()[report_source]
+    scraper = scrapers.scraper_classes()[config['scraper']]()
 
     if url: # Scrape specific url/blog (an older one)
         content = scraper.scrape_post(url)
         latest_post_date = scraper.new_post_date
     else: # Check for and scrape the latest and update the date of latest
         source = get_or_create_source(config, wv_client)
-        try:
-            last_time_scraped = datetime.fromisoformat(source['lastPostDate']) 
-        except:
-            last_time_scraped = datetime.strptime('2023-05-15T00:00:00Z', "%Y-%m-%dT%H:%M:%SZ").astimezone()
+        last_time_scraped = last_post_date(source)
 
         latest_post_url, latest_post_date = scraper.get_latest_post_meta()
 
@@ -104,68 +178,27 @@ def scrape_threatintel_report(report_source, url=None, wv_client=None):
     return results
 
 
-def text_splitter(text, n, tokenizer):
-    chunks = []
-    chunk = ''
-    sentences = [s.strip().replace('\n', ' ') for s in text.split('.')]
-    for s in sentences:
-        # start new chunk
-        if chunk == '':
-            chunk = s
-        else:
-            chunk = chunk + ' ' + s
-        
-        chunk_len = len(tokenizer.encode(chunk))
-        if chunk_len >= 0.9*n:
-            chunks.append(chunk)
-            chunk = ''
+def handle_pdf(report_path, n, tokenizer, data=None, workers=1):
+    # `data` is the PDF already in memory, report_path then only names it
+    if data is None:
+        data = report_path.read_bytes()
 
-    if chunk != '':
-        chunks.append(chunk)
-    
-    return chunks
-
-
-def multi_page_text_splitter(pages, n, tokenizer):
-    chunks = []
-    page_nums = []
-    chunk = ''
-    for num, page in enumerate(pages):
-        sentences = [s.strip().replace('\n', ' ') for s in page.split('.')]
-        for s in sentences:
-            # start new chunk
-            if chunk == '':
-                chunk = s
-            else:
-                chunk = chunk + ' ' + s
-            
-            chunk_len = len(tokenizer.encode(chunk))
-            if chunk_len >= 0.9*n:
-                chunks.append(chunk)
-                page_nums.append(num+1)
-                chunk = ''
-
-    if chunk != '':
-        chunks.append(chunk)
-        page_nums.append(num+1)
-    
-    return chunks, page_nums
-
-
-def handle_pdf(report_path, n, tokenizer):
-    reader = PdfReader(report_path)
+    # one parse for the metadata, page count and (unpooled) page text
+    reader = open_pdf(data)
+    metadata = reader.metadata or {}
     print(report_path.name)
     print('Found {} pages'.format(len(reader.pages)))
 
-    pages = [p.extract_text() for p in reader.pages]
-    chunks, pages = multi_page_text_splitter(pages, n, tokenizer)
+    pages = iter_page_text(data, workers=workers, reader=reader)
+    # text with no full stops (tables, code) would otherwise end up in one huge chunk
+    chunks, pages = multi_page_text_splitter(pages, n, tokenizer, max_tokens=2*n)
 
     # add metadata to chunk
-    if '/CreationDate' in reader.metadata:
-        if '+' in reader.metadata['/CreationDate']:
-            date = reader.metadata['/CreationDate'].split('+')[0].replace('D:','')
+    if '/CreationDate' in metadata:
+        if '+' in metadata['/CreationDate']:
+            date = metadata['/CreationDate'].split('+')[0].replace('D:','')
         else:
-            date = reader.metadata['/CreationDate'].split('-')[0].replace('D:','')
+            date = metadata['/CreationDate'].split('-')[0].replace('D:','')
         try:
             date = datetime.strptime(date, '%Y%m%d%H%M%S').astimezone().isoformat()
         except:
@@ -174,14 +207,15 @@ def handle_pdf(report_path, n, tokenizer):
         short_date = date.split('T')[0]
     else:
         date = ''
+        short_date = ''
 
-    if '/Author' in reader.metadata:
-        author = reader.metadata['/Author']
+    if '/Author' in metadata:
+        author = metadata['/Author']
     else:
         author = ''
 
-    if '/Title' in reader.metadata:
-        title = reader.metadata['/Title'].replace(' ', '_')
+    if '/Title' in metadata:
+        title = metadata['/Title'].replace(' ', '_')
     else:
         title = ''
 
@@ -212,7 +246,7 @@ def handle_json(report_path, n, tokenizer):
     with open(report_path, 'r') as file:
         report_json = json.load(file)
     
-    chunks = text_splitter(report_json['content'], n, tokenizer)
+    chunks = text_splitter(report_json['content'], n, tokenizer, max_tokens=2*n)
     pages = [0 for _ in range(len(chunks))]
 
     title = report_json['title']
@@ -240,76 +274,279 @@ def handle_json(report_path, n, tokenizer):
     return chunks, pages, meta
 
 
-@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
-def load_openai_embedding(data_props, class_name, uuid, wv_client):
-    try:
-        wv_client.data_object.create(data_props, class_name, uuid)
-    except wv.ObjectAlreadyExistsException:
-        pass
+class RateLimited(Exception):
+    pass
+
 
+def is_rate_limited(message):
+    return '429' in message or 'rate limit' in message.lower()
+
+
+UUID_PATTERN = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+
+def beacon_uuids(reference):
+    """The uuids in a batch reference's 'from' and 'to' beacons."""
+    return [uuid for key in ('from', 'to') for uuid in UUID_PATTERN.findall(reference.get(key) or '')]
+
+
+class BatchLoader():
+    """Weaviate batch import of chunks, reports and their references, shared across reports.
+
+    Objects the vectorizer turned away with a 429 are queued again and resent
+    after an exponential backoff; any other errors are kept in `errors`.
+    """
+
+    def __init__(self, wv_client, batch_size=100, num_workers=2, dynamic=True):
+        self.wv_client = wv_client
+        self.objects = 0
+        self.references = 0
+        self.errors = []
+        self.failed_ids = set()
+        self._retry = []
+        self._lock = threading.Lock()
+        wv_client.batch.configure(
+            batch_size=batch_size,
+            num_workers=num_workers,
+            dynamic=dynamic,
+            callback=self.check_results
+        )
+
+
+    def check_results(self, results):
+        for item in results or []:
+            errors = (item.get('result') or {}).get('errors')
+            if not errors:
+                continue
+
+            messages = [error['message'] for error in errors.get('error', [])]
+            with self._lock:
+                if 'properties' in item and any(is_rate_limited(message) for message in messages):
+                    self._retry.append(item)
+                else:
+                    self.errors.append(messages)
+                    if 'id' in item:
+                        self.failed_ids.add(item['id'])
+                    else:
+                        # a reference: the objects at both ends are incomplete
+                        self.failed_ids.update(beacon_uuids(item))
+
+
+    def add_object(self, data_props, class_name, uuid, vector=None):
+        # Slow down as soon as the vectorizer starts turning objects away
+        if self._retry:
+            self.flush()
+        self.wv_client.batch.add_data_object(data_props, class_name, uuid=uuid, vector=vector)
+        self.objects += 1
+
+
+    def add_reference(self, from_uuid, from_class_name, from_property_name, to_uuid, to_class_name):
+        # The batch sends objects before the references queued with them
+        self.wv_client.batch.add_reference(
+            from_object_uuid=from_uuid,
+            from_object_class_name=from_class_name,
+            from_property_name=from_property_name,
+            to_object_uuid=to_uuid,
+            to_object_class_name=to_class_name,
+        )
+        self.references += 1
+
+
+    @retry(retry=retry_if_exception_type(RateLimited), wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6), reraise=True)
+    def flush(self):
+        with self._lock:
+            items, self._retry = self._retry, []
+        for item in items:
+            self.wv_client.batch.add_data_object(item['properties'], item['class'], uuid=item['id'], vector=item.get('vector'))
+        self.wv_client.batch.flush()
+
+        if self._retry:
+            raise RateLimited('{} objects were rate limited'.format(len(self._retry)))
+
+
+class IngestManifest():
+    """Report file hashes and object uuids already loaded into Weaviate, in sqlite.
+
+    Chunk and report uuids are uuid5s of their content, so a known uuid means
+    known content: it can be skipped before it is embedded or sent anywhere.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS reports (hash TEXT PRIMARY KEY, path TEXT, uuid TEXT, objects INTEGER, loaded REAL)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS objects (uuid TEXT PRIMARY KEY)')
+
+
+    def has_report(self, report_hash):
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM reports WHERE hash = ?', (report_hash,)).fetchone() is not None
+
+
+    def known(self, uuids):
+        uuids = [str(uuid) for uuid in uuids]
+        found = set()
+        with self._lock:
+            for i in range(0, len(uuids), 500):
+                batch = uuids[i:i+500]
+                found.update(row[0] for row in self._conn.execute(
+                    'SELECT uuid FROM objects WHERE uuid IN ({})'.format(','.join('?'*len(batch))),
+                    batch
+                ))
+
+        return found
+
+
+    def record(self, report_hash, path, report_uuid, uuids):
+        uuids = [str(uuid) for uuid in uuids]
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR IGNORE INTO objects (uuid) VALUES (?)', [(uuid,) for uuid in uuids])
+            if report_hash:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO reports (hash, path, uuid, objects, loaded) VALUES (?, ?, ?, ?, ?)',
+                    (report_hash, str(path), str(report_uuid), len(uuids), time.time())
+                )
+
+
+def file_hash(path):
+    return hashlib.sha256(pathlib.Path(path).read_bytes()).hexdigest()
+
+
+def existing_uuids(wv_client, class_name, uuids, batch_size=100):
+    """The subset of `uuids` Weaviate already has, in one query per `batch_size` ids."""
+    uuids = [str(uuid) for uuid in uuids]
+    found = set()
+    for i in range(0, len(uuids), batch_size):
+        operands = [
+            {"path": ["id"], "operator": "Equal", "valueString": uuid}
+            for uuid in uuids[i:i+batch_size]
+        ]
+        where_filter = operands[0] if len(operands) == 1 else {"operator": "Or", "operands": operands}
+
+        result = (
+            wv_client.query
+            .get(class_name, "_additional{ id }")
+            .with_where(where_filter)
+            .with_limit(len(operands))
+            .do()
+        )
+        found.update(obj['_additional']['id'] for obj in result['data']['Get'][class_name])
+
+    return found
+
+
+def report_uuids(chunks, meta):
+    chunk_uuids = [generate_uuid5({'chunk': chunk}, 'ThreatIntelChunk') for chunk in chunks]
+    return chunk_uuids, generate_uuid5(meta, 'ThreatIntelReport')
+
+
+def known_uuids(chunks, meta, manifest=None, wv_client=None):
+    """Chunk and report uuids already loaded, per the manifest and then (optionally) Weaviate itself."""
+    chunk_uuids, report_uuid = report_uuids(chunks, meta)
+    known = manifest.known(chunk_uuids + [report_uuid]) if manifest else set()
+
+    if wv_client is not None:
+        known |= existing_uuids(wv_client, 'ThreatIntelChunk', [uuid for uuid in set(chunk_uuids) if uuid not in known])
+        if report_uuid not in known:
+            known |= existing_uuids(wv_client, 'ThreatIntelReport', [report_uuid])
+
+    return known
+
+
+def record_report(manifest, loader, report_hash, path, chunk_uuids, report_uuid):
+    """Call after loader.flush(): remember what made it into Weaviate."""
+    uuids = set(map(str, chunk_uuids + [report_uuid]))
+    failed = uuids & loader.failed_ids
+    # a report with failed objects is read again next time
+    manifest.record(None if failed else report_hash, path, report_uuid, uuids - failed)
+
+
+def read_threatintel_report(path, chunk_size=100, pdf_workers=1):
+    import tiktoken
 
-def load_threatintel_report(path, chunk_size=100, wv_client=None):
     tokenizer = tiktoken.get_encoding("cl100k_base")
     report_path = pathlib.Path(path)
 
     if report_path.name.endswith('.pdf'):
-        chunks, pages, meta = handle_pdf(report_path, chunk_size, tokenizer)
+        return handle_pdf(report_path, chunk_size, tokenizer, workers=pdf_workers)
     elif report_path.name.endswith('.json'):
-        chunks, pages, meta = handle_json(report_path, chunk_size, tokenizer)
+        return handle_json(report_path, chunk_size, tokenizer)
 
-    print('Getting embeddings for {} chunks'.format(len(chunks)))
+    raise ValueError('Unsupported report type: {}'.format(report_path.name))
 
-    if not wv_client:
-        return chunks, pages, meta
 
-    # Load into weaviate
-    # 1. load all chunks
-    # 2. load report
-    # 3. add report ref to chunks
-    # 4. add chunk refs to report 
+def add_threatintel_report(loader, chunks, pages, meta, embeddings=None, known=()):
+    """Queue a report's new objects and the references that touch them; returns (report uuid, uuids added)."""
+    chunk_uuids, report_uuid = report_uuids(chunks, meta)
+    known = set(known)
 
-    # all chunks
-    chunk_uuids = []
-    for chunk, page in zip(chunks, pages):
-        data_props = {
-            "chunk": chunk,
-            "page": page
-        }
+    # Known chunks (and repeats within the report) aren't embedded or sent again
+    new = []
+    seen = set(known)
+    for idx, uuid in enumerate(chunk_uuids):
+        if uuid not in seen:
+            seen.add(uuid)
+            new.append(idx)
 
-        uuid = wv.util.generate_uuid5({'chunk': chunk}, 'ThreatIntelChunk')
-        chunk_uuids.append(uuid)
+    # Embed chunks client side when given a (cached) embeddings model,
+    # otherwise Weaviate vectorizes them on import
+    if embeddings is not None and new:
+        vectors = embeddings.embed_documents([chunks[idx] for idx in new])
+    else:
+        vectors = [None for _ in new]
 
-        load_openai_embedding(data_props, 'ThreatIntelChunk', uuid, wv_client)
-    print('Chunks loaded')
+    # new chunks
+    for idx, vector in zip(new, vectors):
+        data_props = {
+            "chunk": chunks[idx],
+            "page": pages[idx]
+        }
+        loader.add_object(data_props, 'ThreatIntelChunk', chunk_uuids[idx], vector=vector)
+    added = [chunk_uuids[idx] for idx in new]
 
     # the report
-    data_props = meta
-
-    report_uuid = wv.util.generate_uuid5(data_props, 'ThreatIntelReport')
+    if report_uuid not in known:
+        loader.add_object(meta, 'ThreatIntelReport', report_uuid)
+        added.append(report_uuid)
+
+    # report ref on each chunk, and chunk refs on the report. Weaviate appends a
+    # reference that's sent again, so skip those between objects already loaded
+    for chunk_uuid in dict.fromkeys(chunk_uuids):
+        if chunk_uuid in known and report_uuid in known:
+            continue
+        loader.add_reference(chunk_uuid, 'ThreatIntelChunk', 'fromReport', report_uuid, 'ThreatIntelReport')
+        loader.add_reference(report_uuid, 'ThreatIntelReport', 'hasChunks', chunk_uuid, 'ThreatIntelChunk')
+
+    return report_uuid, added
+
+
+def load_threatintel_report(path, chunk_size=100, wv_client=None, embeddings=None, pdf_workers=1, loader=None,
+                            manifest=None, check_weaviate=False):
+    loading = wv_client or loader
+    report_hash = file_hash(path) if manifest and loading else None
+    if report_hash and manifest.has_report(report_hash):
+        print('Skipping {}, already loaded'.format(path))
+        return
+
+    chunks, pages, meta = read_threatintel_report(path, chunk_size, pdf_workers)
+    print('Getting embeddings for {} chunks'.format(len(chunks)))
 
-    load_openai_embedding(data_props, 'ThreatIntelReport', report_uuid, wv_client)
-    print('Report loaded')
+    if not loading:
+        return chunks, pages, meta
 
-    # attach report ref to chunks
-    for chunk_uuid in chunk_uuids:
-        wv_client.batch.add_reference(
-            from_object_uuid=chunk_uuid,
-            from_object_class_name='ThreatIntelChunk',
-            from_property_name="fromReport",
-            to_object_uuid=report_uuid,
-            to_object_class_name='ThreatIntelReport',
-        )
-    wv_client.batch.flush()
-    print('Report ref attached to Chunks')
-
-    # attach chunk refs to report
-    for chunk_uuid in chunk_uuids:
-        wv_client.data_object.reference.add(
-            from_uuid=report_uuid,
-            from_property_name='hasChunks',
-            to_uuid=chunk_uuid,
-            from_class_name='ThreatIntelReport',
-            to_class_name='ThreatIntelChunk',
-        )
-    print('Chunk refs attached to report')
-    print('')
\ No newline at end of file
+    # Load into weaviate with the batch API: new chunks and the report, then
+    # the references both ways
+    loader = loader or BatchLoader(wv_client)
+    known = known_uuids(chunks, meta, manifest, loader.wv_client if check_weaviate else None)
+    references = loader.references
+    report_uuid, added = add_threatintel_report(loader, chunks, pages, meta, embeddings, known=known)
+    loader.flush()
+    print('Loaded {} new objects, skipped {}, {} refs'.format(
+        len(added), len(chunks) + 1 - len(added), loader.references - references
+    ))
+    print('')
+
+    if manifest:
+        record_report(manifest, loader, report_hash, path, report_uuids(chunks, meta)[0], report_uuid)
\ No newline at end of file
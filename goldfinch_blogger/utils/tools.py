@@ -3,7 +3,7 @@ try:
 except:
   pass
 
-from langchain.utilities import GoogleSerperAPIWrapper
+from utils.search import search_client
 
 
 def get_intel_chunks(retriever, query):
@@ -15,8 +15,7 @@ def get_intel_chunks(retriever, query):
 
 
 def get_search_snippets(query):
-    search = GoogleSerperAPIWrapper()
-    search_result = search.results(query)
+    search_result = search_client.results(query)
     
     snippets = []
     sources = []
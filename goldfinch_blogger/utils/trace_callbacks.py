@@ -0,0 +1,57 @@
+"""LLM callback handler that adds each call's tokens, cache hit and cost to the open trace span.
+
+Kept out of utils.tracing so the tracer can be imported without langchain.
+"""
+import threading
+from typing import Any
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+from utils.tracing import tracer, count_tokens, price
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """Adds every LLM call's tokens, cache hit and cost to the span it's made in."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._prompts = {}
+        self._streamed = {}
+
+
+    def on_llm_start(self, serialized, prompts, run_id=None, **kwargs: Any):
+        with self._lock:
+            self._prompts[run_id] = prompts
+
+
+    def on_llm_new_token(self, token, run_id=None, **kwargs: Any):
+        with self._lock:
+            self._streamed[run_id] = self._streamed.get(run_id, 0) + 1
+
+
+    def on_llm_end(self, response, run_id=None, **kwargs: Any):
+        with self._lock:
+            prompts = self._prompts.pop(run_id, [])
+            streamed = self._streamed.pop(run_id, 0)
+
+        llm_output = response.llm_output or {}
+        usage = llm_output.get('token_usage') or {}
+        if streamed and not usage:
+            # streamed completions don't report usage, count it ourselves
+            usage = {'prompt_tokens': count_tokens(prompts), 'completion_tokens': streamed}
+        prompt_tokens = usage.get('prompt_tokens', 0)
+        completion_tokens = usage.get('completion_tokens', 0)
+
+        tracer.add(
+            llm_calls=1,
+            llm_cache_hits=1 if llm_output.get('cached') else 0,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cost=price(llm_output.get('model_name'), prompt_tokens, completion_tokens)
+        )
+
+
+    def on_llm_error(self, error, run_id=None, **kwargs: Any):
+        with self._lock:
+            self._prompts.pop(run_id, None)
+            self._streamed.pop(run_id, None)
@@ -0,0 +1,240 @@
+"""Per-stage timing, token, cache and error tracing for a blog run.
+
+Stages open spans with `tracer.span(stage, **attrs)`. A span inherits the
+post, section, url and query of the span it's opened in, also in threads
+started through `tracer.wrap`. Counters (tokens, embeddings, cache hits,
+cost) go to the innermost open span with `tracer.add`, from wherever they're
+known: the LLM callback handler in utils.trace_callbacks, the embedding
+cache, the search client.
+Span seconds include the spans nested in them, counters don't.
+"""
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+
+INHERITED = ('post', 'section', 'url', 'query')
+
+# USD per 1K (prompt, completion) tokens, list prices as of mid 2023
+PRICES = {
+    'gpt-3.5-turbo': (0.0015, 0.002),
+    'gpt-3.5-turbo-16k': (0.003, 0.004),
+    'gpt-4': (0.03, 0.06),
+    'gpt-4-32k': (0.06, 0.12),
+    'text-embedding-ada-002': (0.0001, 0.0),
+}
+
+_current = contextvars.ContextVar('trace_span', default=None)
+_encoder = None
+
+
+def count_tokens(texts):
+    global _encoder
+    if _encoder is None:
+        import tiktoken
+        _encoder = tiktoken.get_encoding('cl100k_base')
+
+    return sum(len(_encoder.encode(text)) for text in texts)
+
+
+def price(model, prompt_tokens, completion_tokens=0):
+    prompt_price, completion_price = PRICES.get(model, PRICES['gpt-3.5-turbo'])
+
+    return (prompt_tokens*prompt_price + completion_tokens*completion_price) / 1000
+
+
+class Span():
+
+    def __init__(self, tracer, id, parent, stage, attrs):
+        self.tracer = tracer
+        self.id = id
+        self.parent = parent
+        self.stage = stage
+        self.attrs = attrs
+        self.counts = {}
+        self.start = time.monotonic()
+        self.seconds = None
+        self.error = None
+
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+    def add(self, **counts):
+        with self.tracer._lock:
+            for name, value in counts.items():
+                self.counts[name] = self.counts.get(name, 0) + value
+
+
+    def to_dict(self, started):
+        return {
+            'id': self.id,
+            'parent': self.parent,
+            'stage': self.stage,
+            **self.attrs,
+            'start': round(self.start - started, 3),
+            'seconds': self.seconds,
+            'error': self.error,
+            **self.counts
+        }
+
+
+class Tracer():
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.start()
+
+
+    def start(self):
+        """Forget earlier spans, a run's trace starts now."""
+        with self._lock:
+            self.spans = []
+            self.unattributed = {}
+            self._next_id = 0
+            self.started = time.monotonic()
+            self.started_at = datetime.now().astimezone().isoformat()
+
+
+    def _open(self, stage, attrs):
+        parent = _current.get()
+        inherited = {key: parent.attrs[key] for key in INHERITED if parent is not None and key in parent.attrs}
+        with self._lock:
+            span = Span(self, self._next_id, parent.id if parent else None, stage, dict(inherited, **attrs))
+            self._next_id += 1
+            self.spans.append(span)
+
+        return span
+
+
+    @contextmanager
+    def span(self, stage, **attrs):
+        span = self._open(stage, attrs)
+        token = _current.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.seconds = round(time.monotonic() - span.start, 3)
+            _current.reset(token)
+
+
+    def event(self, stage, seconds=0.0, error=None, **attrs):
+        """A span for something that happened out of band, like a dropped url."""
+        span = self._open(stage, attrs)
+        span.seconds = round(seconds, 3)
+        span.error = error
+
+
+    def add(self, **counts):
+        span = _current.get()
+        if span is not None:
+            span.add(**counts)
+            return
+
+        with self._lock:
+            for name, value in counts.items():
+                self.unattributed[name] = self.unattributed.get(name, 0) + value
+
+
+    def wrap(self, fn):
+        """fn, run in a copy of the current context, for handing to another thread."""
+        context = contextvars.copy_context()
+
+        return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+    def split(self, post):
+        """Move the spans of one post to a new Tracer, e.g. to save a job's trace and free its spans."""
+        tracer = Tracer()
+        with self._lock:
+            tracer.spans = [span for span in self.spans if span.attrs.get('post') == post]
+            self.spans = [span for span in self.spans if span.attrs.get('post') != post]
+        # the new trace starts with its first span
+        tracer.started = min((span.start for span in tracer.spans), default=self.started)
+        tracer.started_at = (datetime.now().astimezone() - timedelta(seconds=time.monotonic() - tracer.started)).isoformat()
+
+        return tracer
+
+
+    def rows(self):
+        with self._lock:
+            return [span.to_dict(self.started) for span in self.spans]
+
+
+    def summary(self, key):
+        """Totals of every span grouped by `key` (stage, section, url, ...)."""
+        with self._lock:
+            spans = list(self.spans)
+        by_id = {span.id: span for span in spans}
+
+        def value(span):
+            return span.stage if key == 'stage' else span.attrs.get(key)
+
+        groups = {}
+        for span in spans:
+            if value(span) is None:
+                continue
+            group = groups.setdefault(value(span), {key: value(span), 'spans': 0, 'errors': 0, 'seconds': []})
+            group['spans'] += 1
+            group['errors'] += span.error is not None
+            # time nested in a span of the same group is already in that span's seconds
+            parent = by_id.get(span.parent)
+            if span.seconds is not None and (parent is None or value(parent) != value(span)):
+                group['seconds'].append(span.seconds)
+            for name, count in span.counts.items():
+                group[name] = group.get(name, 0) + count
+
+        for group in groups.values():
+            seconds = sorted(group['seconds'])
+            group['seconds'] = round(sum(seconds), 3)
+            group['p50'] = seconds[len(seconds) // 2] if seconds else None
+            group['max'] = seconds[-1] if seconds else None
+            group['cost'] = round(group.get('cost', 0), 5)
+
+        return list(groups.values())
+
+
+    def save(self, path, **extra):
+        trace = {
+            'started': self.started_at,
+            'seconds': round(time.monotonic() - self.started, 3),
+            **extra,
+            'unattributed': self.unattributed,
+            'by_stage': self.summary('stage'),
+            'by_section': self.summary('section'),
+            'by_url': self.summary('url'),
+            'spans': self.rows()
+        }
+        with open(path + '.tmp', 'w') as f:
+            json.dump(trace, f, indent=2, default=str)
+        os.replace(path + '.tmp', path)
+
+        return trace
+
+
+    def print_summary(self, keys=('stage', 'section')):
+        from tabulate import tabulate
+
+        columns = [
+            ('spans', 'spans'), ('seconds', 'seconds'), ('p50', 'p50'), ('max', 'max'),
+            ('prompt_tokens', 'prompt tok'), ('completion_tokens', 'completion tok'),
+            ('embedded', 'embedded'), ('cache_hits', 'cache hits'), ('errors', 'errors'), ('cost', 'cost $')
+        ]
+        for key in keys:
+            rows = []
+            for group in self.summary(key):
+                group['cache_hits'] = sum(value for name, value in group.items() if name.endswith('cache_hits'))
+                rows.append([group[key]] + [group.get(name, 0) for name, _ in columns])
+            print(tabulate(rows, headers=[key] + [header for _, header in columns], floatfmt='.3g'))
+            print()
+
+
+tracer = Tracer()